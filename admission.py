@@ -0,0 +1,173 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+
+
+class AdmissionError(Exception):
+    """A request was turned away before reaching the backend. `status` is the HTTP status to answer with."""
+
+    status = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionError):
+    status = 429
+
+
+class DeadlineExceeded(AdmissionError):
+    status = 503
+
+
+class Cancelled(AdmissionError):
+    """The caller no longer wants the answer, e.g. another backend already won a race."""
+
+    status = 503
+
+
+class AdmissionController:
+    """Bounded admission queue in front of one backend.
+
+    At most `max_in_flight` requests run at once; up to `max_queue` more wait for a
+    free place. Anything beyond that is rejected at once with QueueFull, and a
+    waiting request whose deadline passes gets DeadlineExceeded, so under overload
+    callers fail fast instead of piling onto the backend until they time out.
+    """
+
+    CANCEL_POLL = 0.1  # Seconds between checks of a waiting request's `cancelled` event
+
+    def __init__(self, name, max_in_flight=2, max_queue=16):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.service_seconds = 10.0  # Moving average of how long a request holds its place
+        self.counters = {'admitted': 0, 'rejected': 0, 'timed_out': 0}
+
+    def retry_after(self):
+        """Seconds until a place is likely to free up, for the Retry-After header."""
+        backlog = (self.waiting + 1) / max(self.max_in_flight, 1)
+        return max(1, int(round(backlog * self.service_seconds)))
+
+    def is_full(self):
+        with self.condition:
+            return self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue
+
+    @contextmanager
+    def admit(self, deadline=None, cancelled=None):
+        """Holds one of the in-flight places for the duration of the block.
+
+        `deadline` is a `time.monotonic()` value; waiting stops there, or as soon as the
+        `cancelled` threading.Event is set. Yields the seconds spent waiting in the queue.
+        """
+        start = time.monotonic()
+        with self.condition:
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.max_queue:
+                    self.counters['rejected'] += 1
+                    raise QueueFull(f"{self.name} is busy ({self.in_flight} running, {self.waiting} queued)",
+                                    self.retry_after())
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self.counters['timed_out'] += 1
+                            raise DeadlineExceeded(f"Timed out waiting for {self.name}", self.retry_after())
+                        if cancelled is not None:
+                            if cancelled.is_set():
+                                raise Cancelled(f"Stopped waiting for {self.name}", self.retry_after())
+                            remaining = self.CANCEL_POLL if remaining is None else min(remaining, self.CANCEL_POLL)
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.counters['admitted'] += 1
+
+        admitted = time.monotonic()
+        STAGE_SECONDS.observe(admitted - start, stage='queue_wait')
+        try:
+            yield admitted - start
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.service_seconds = 0.8 * self.service_seconds + 0.2 * (time.monotonic() - admitted)
+                self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counters, in_flight=self.in_flight, waiting=self.waiting,
+                        max_in_flight=self.max_in_flight, max_queue=self.max_queue)
+
+
+class AdmittedLLM:
+    """Wraps a backend so every call to it goes through an AdmissionController first.
+
+    `deadline` bounds the whole call, queueing included: the backend gets the time
+    left as its `timeout`, a stream is cut off once it passes, and a backend error
+    after it is reported as DeadlineExceeded. Setting the `cancelled` threading.Event
+    gives up a place in the queue and ends a stream at its next piece.
+    """
+
+    def __init__(self, llm, controller, deadline=None, cancelled=None):
+        self.llm = llm
+        self.controller = controller
+        self.deadline = deadline
+        self.cancelled = cancelled
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def deadline_passed(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def check_deadline(self):
+        if self.deadline_passed():
+            raise DeadlineExceeded(f"Request deadline passed before {self.controller.name} was asked",
+                                   self.controller.retry_after())
+
+    def deadline_exceeded(self):
+        return DeadlineExceeded(f"{self.controller.name} did not answer before the request deadline",
+                                self.controller.retry_after())
+
+    def with_timeout(self, kwargs):
+        """`kwargs` plus the seconds left until the deadline as the backend call's `timeout`."""
+        if self.deadline is None:
+            return kwargs
+        self.check_deadline()
+        return dict(kwargs, timeout=self.deadline - time.monotonic())
+
+    def completion(self, prompt, **kwargs):
+        self.check_deadline()
+        with self.controller.admit(self.deadline, self.cancelled), STAGE_SECONDS.time(stage='llm_generation'):
+            try:
+                return self.llm.completion(prompt, **self.with_timeout(kwargs))
+            except AdmissionError:
+                raise
+            except Exception as e:
+                if self.deadline_passed():
+                    raise self.deadline_exceeded() from e
+                raise
+
+    def completion_stream(self, prompt, **kwargs):
+        self.check_deadline()
+        with self.controller.admit(self.deadline, self.cancelled), STAGE_SECONDS.time(stage='llm_generation'):
+            try:
+                for piece in self.llm.completion_stream(prompt, **self.with_timeout(kwargs)):
+                    yield piece
+                    if self.deadline_passed():
+                        raise self.deadline_exceeded()
+                    if self.cancelled is not None and self.cancelled.is_set():
+                        raise Cancelled(f"{self.controller.name} answer no longer needed", 0)
+            except AdmissionError:
+                raise
+            except Exception as e:
+                if self.deadline_passed():
+                    raise self.deadline_exceeded() from e
+                raise
@@ -0,0 +1,162 @@
+import json
+
+
+def strip_think(answer):
+    """Drops a leading `<think>...</think>` block emitted by reasoning models."""
+    if "</think>" in answer:
+        return answer.split("</think>", 1)[1].strip()
+    return answer
+
+
+def parse_answer(answer):
+    """Parses the JSON blob of an LLM answer, which may be wrapped in a ``` code block."""
+    answer = strip_think(answer)
+    if "```" in answer:
+        answer = "{" + answer.split("```")[1].split("{", 1)[1]
+    return json.loads(answer)
+
+
+def parse_alternatives(answer):
+    """Returns the `translations` list of an answer, raising ValueError unless it holds exactly 4 strings."""
+    if answer is None:
+        raise ValueError('LLM returned no answer')
+    try:
+        alternatives = parse_answer(answer)["translations"]
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError(f'LLM did not return the expected format: {e!r}')
+    if not isinstance(alternatives, list) or len(alternatives) != 4:
+        raise ValueError('LLM did not return the expected format')
+    return alternatives
+
+
+def parse_single_translation(answer):
+    """Returns the `translation` string of a one-alternative answer, raising ValueError otherwise."""
+    if answer is None:
+        raise ValueError('LLM returned no answer')
+    try:
+        translation = parse_answer(answer)["translation"]
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError(f'LLM did not return the expected format: {e!r}')
+    if not isinstance(translation, str) or not translation.strip():
+        raise ValueError('LLM did not return the expected format')
+    return translation.strip()
+
+
+def normalize_alternative(text):
+    """Comparison key under which two alternatives count as the same translation."""
+    return ' '.join(text.casefold().split()).rstrip('.!?…')
+
+
+def parse_packed(answer, sentences):
+    """Maps the sentences of a packed prompt to their 4 alternatives.
+
+    The answer is a JSON array of `{original_phrase, translations}` objects, possibly in
+    a ``` code block. Entries are matched by `original_phrase`, or by position when the
+    model altered the phrase but kept one entry per sentence. Sentences without a well-formed entry are left out, so the
+    caller can retry just those. Raises ValueError if there is no array at all.
+    """
+    if answer is None:
+        raise ValueError('LLM returned no answer')
+    answer = strip_think(answer)
+    if "```" in answer:
+        answer = answer.split("```")[1]
+    start = answer.find("[")
+    if start < 0:
+        raise ValueError('LLM did not return a JSON array')
+    try:
+        entries = json.loads(answer[start:answer.rfind("]") + 1])
+    except ValueError as e:
+        raise ValueError(f'LLM did not return the expected format: {e!r}')
+    if not isinstance(entries, list):
+        raise ValueError('LLM did not return a JSON array')
+
+    def alternatives_of(entry):
+        alternatives = entry.get("translations") if isinstance(entry, dict) else None
+        if isinstance(alternatives, list) and len(alternatives) == 4 and all(isinstance(a, str) for a in alternatives):
+            return alternatives
+        return None
+
+    results = {}
+    unmatched = []
+    wanted = set(sentences)
+    for position, entry in enumerate(entries):
+        alternatives = alternatives_of(entry)
+        if alternatives is None:
+            continue
+        phrase = str(entry.get("original_phrase", "")).strip()
+        if phrase in wanted and phrase not in results:
+            results[phrase] = alternatives
+        else:
+            unmatched.append((position, alternatives))
+    for position, alternatives in unmatched:
+        if len(entries) == len(sentences) and sentences[position] not in results:
+            results[sentences[position]] = alternatives
+    return results
+
+
+class TranslationsStreamParser:
+    """Incrementally extracts the strings of the `translations` array from a streamed answer.
+
+    Feed it text as it arrives; each call returns the alternatives that were completed
+    by that chunk, so they can be shown before the generation ends.
+    """
+
+    KEY = '"translations"'
+
+    def __init__(self):
+        self.buffer = ''
+        self.position = None  # Scan position inside the array, None until `[` is seen
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.done = False
+        self.alternatives = []
+
+    def feed(self, text):
+        self.buffer += text
+        if self.done:
+            return []
+        if self.position is None and not self._find_array():
+            return []
+
+        completed = []
+        buffer = self.buffer
+        position = self.position
+        while position < len(buffer):
+            char = buffer[position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    alternative = json.loads(buffer[self.string_start:position + 1])
+                    self.alternatives.append(alternative)
+                    completed.append(alternative)
+            elif char == '"':
+                self.in_string = True
+                self.string_start = position
+            elif char == ']':
+                self.done = True
+                position += 1
+                break
+            position += 1
+        self.position = position
+        return completed
+
+    def _find_array(self):
+        search_from = 0
+        if "<think>" in self.buffer:
+            end = self.buffer.find("</think>")
+            if end < 0:
+                return False
+            search_from = end
+        key = self.buffer.find(self.KEY, search_from)
+        if key < 0:
+            return False
+        bracket = self.buffer.find('[', key + len(self.KEY))
+        if bracket < 0:
+            return False
+        self.position = bracket + 1
+        return True
@@ -1,12 +1,165 @@
-from flask import Flask, render_template, request, jsonify
-from qwen_local import LLM as QwenLLM
+from flask import Flask, Response, g, render_template, request, jsonify
+from qwen_local import (LLM as QwenLLM, ALTERNATIVE_VARIANTS, SINGLE_TRANSLATION_GRAMMAR, TRANSLATIONS_GRAMMAR,
+                        packed_translations_grammar)
 from gemini import LLM as GeminiLLM
+from translation_memory import TranslationMemory
+from tokens import estimate_tokens
+from glossary import Glossary
+from answer_parser import (normalize_alternative, parse_alternatives, parse_packed, parse_single_translation,
+                           TranslationsStreamParser)
+from response_cache import ResponseCache, CachedLLM
+from batch_translate import split_sentences, translate_document, translate_document_packed
+from packing import estimate_answer_tokens, plan_packs, translate_packed
+from race import BackendRace
+from prefetch import Prefetcher
+from admission import AdmissionController, AdmissionError, AdmittedLLM, QueueFull
+from metrics import REGISTRY, STAGE_SECONDS
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import json
-import yaml
 import os
+import random
+import threading
+import time
+import zlib
 
 app = Flask(__name__)
-llm_instance = QwenLLM()  # Default to Qwen
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 180))  # Seconds a translation may take, queueing included
+QWEN_JSON_GRAMMAR = os.environ.get('QWEN_JSON_GRAMMAR', '1') == '1'
+# Backends live for the whole process so their connection pools are reused across requests
+backends = {
+    'qwen': QwenLLM(  # Default
+        url=os.environ.get('QWEN_URL', 'http://localhost:8080'),
+        timeout=REQUEST_DEADLINE,
+        # Constrain the output to the answer JSON so it always parses and no tokens are wasted on prose
+        grammar=TRANSLATIONS_GRAMMAR if QWEN_JSON_GRAMMAR else "",
+        no_think=os.environ.get('QWEN_NO_THINK', '1') == '1',
+        context_tokens=int(os.environ.get('QWEN_CONTEXT_TOKENS', 8192)),  # Per slot: --ctx-size / --parallel
+    ),
+    'gemini': GeminiLLM(
+        # Client-side budgets in requests and tokens per minute; 0 disables a bucket
+        primary_rate_limits=(int(os.environ.get('GEMINI_RPM', GeminiLLM.PRIMARY_RATE_LIMITS[0])),
+                             int(os.environ.get('GEMINI_TPM', GeminiLLM.PRIMARY_RATE_LIMITS[1]))),
+        fallback_rate_limits=(int(os.environ.get('GEMINI_FALLBACK_RPM', GeminiLLM.FALLBACK_RATE_LIMITS[0])),
+                              int(os.environ.get('GEMINI_FALLBACK_TPM', GeminiLLM.FALLBACK_RATE_LIMITS[1]))),
+    ),
+}
+# Bounded queues in front of each backend; beyond them requests are rejected with 429
+admission = {
+    'qwen': AdmissionController('qwen', max_in_flight=int(os.environ.get('QWEN_MAX_IN_FLIGHT', max(int(os.environ.get('QWEN_SLOTS', 0)), 2))),
+                                max_queue=int(os.environ.get('QWEN_MAX_QUEUE', 16))),
+    'gemini': AdmissionController('gemini', max_in_flight=int(os.environ.get('GEMINI_MAX_IN_FLIGHT', 8)),
+                                  max_queue=int(os.environ.get('GEMINI_MAX_QUEUE', 32))),
+}
+# Saved translations whose original is at least this similar (Dice over character bigrams) are offered as a TM match
+FUZZY_MATCH_THRESHOLD = float(os.environ.get('FUZZY_MATCH_THRESHOLD', 0.8))  # 0 disables
+FUZZY_MATCH_SKIP_LLM = os.environ.get('FUZZY_MATCH_SKIP_LLM', '0') == '1'  # Answer with the TM match alone
+translation_memory = TranslationMemory('translations.yaml', fuzzy_threshold=FUZZY_MATCH_THRESHOLD or 1.0)
+glossary = Glossary('glossary.txt')
+CONTEXT_TOP_K = int(os.environ.get('CONTEXT_TOP_K', 8))  # Max saved translations used as few-shot examples
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 1500))  # Estimated tokens allowed for them
+QWEN_SLOTS = int(os.environ.get('QWEN_SLOTS', 0))  # Slots of the llama.cpp server (--parallel); 0 disables pinning
+RACE_BACKENDS = os.environ.get('RACE_BACKENDS', 'qwen,gemini').split(',')  # Raced when model is 'race'
+RACE_TIMEOUT = float(os.environ.get('RACE_TIMEOUT', 120))
+backend_race = BackendRace()
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+# Generate the 4 Qwen alternatives as 4 concurrent one-translation requests (needs QWEN_MAX_IN_FLIGHT >= 4 and as many slots)
+PARALLEL_ALTERNATIVES = os.environ.get('PARALLEL_ALTERNATIVES', '0') == '1'
+PARALLEL_MAX_ATTEMPTS = int(os.environ.get('PARALLEL_MAX_ATTEMPTS', 3))  # Per alternative, counting regenerations of duplicates
+alternatives_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='alternatives')
+PACK_MAX_SENTENCES = int(os.environ.get('PACK_MAX_SENTENCES', 16))  # Sentences per packed prompt, within the model's token limit
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 512)),
+    ttl_seconds=float(os.environ.get('RESPONSE_CACHE_TTL', 24 * 3600)),
+    sqlite_path=os.environ.get('RESPONSE_CACHE_DB') or None,  # e.g. response_cache.sqlite3 to keep answers across restarts
+)
+text_file_cache = {}  # path -> ((mtime_ns, size), content)
+TRANSLATIONS_PAGE_MAX = int(os.environ.get('TRANSLATIONS_PAGE_MAX', 5000))  # Largest `limit` of /get_translations
+PREFETCH_LOOKAHEAD = int(os.environ.get('PREFETCH_LOOKAHEAD', 3))  # Sentences translated ahead of each session (0 disables)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', 0))  # Fraction of prompts/answers printed
+
+def counted(source):
+    """The monotonic `counters` of an object's stats(), keyed for a labelled metric."""
+    return {(name,): value for name, value in source.stats().items() if name in source.counters}
+
+def uncounted(source):
+    """The rest of an object's stats(): sizes and levels that go up and down."""
+    return {(name,): value for name, value in source.stats().items() if name not in source.counters}
+
+HTTP_REQUESTS = REGISTRY.counter('http_requests_total', 'HTTP requests by endpoint and status.', ['endpoint', 'status'])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('http_request_seconds', 'Seconds until the response (or its first byte, when streamed).', ['endpoint'])
+HTTP_RESPONSE_SECONDS = REGISTRY.histogram('http_response_seconds', 'Seconds until the response was completely sent.', ['endpoint'])
+FIRST_ALTERNATIVE_SECONDS = REGISTRY.histogram('first_alternative_seconds', 'Seconds from a /translate/stream request to its first alternative.', ['model'])
+TRANSLATIONS = REGISTRY.counter('translations_total', 'Translations answered, by backend.', ['model'])
+REGISTRY.gauge('translation_memory_entries', 'Saved translations in the translation memory.', lambda: len(translation_memory))
+REGISTRY.counter_callback('response_cache_events_total', 'Response cache events (hits, misses, evictions, ...).',
+                          lambda: counted(response_cache), ['event'])
+REGISTRY.gauge('response_cache_entries', 'Answers held in memory and on disk by the response cache.',
+               lambda: uncounted(response_cache), ['state'])
+REGISTRY.counter_callback('admission_requests_total', 'Requests admitted, rejected or timed out per backend.',
+                          lambda: {(name, key): value for name, controller in admission.items()
+                                   for (key,), value in counted(controller).items()}, ['backend', 'event'])
+REGISTRY.gauge('admission_queue', 'Admission queue state and limits per backend.',
+               lambda: {(name, key): value for name, controller in admission.items()
+                        for (key,), value in uncounted(controller).items()}, ['backend', 'state'])
+REGISTRY.counter_callback('prefetch_events_total', 'Background prefetch events (prefetched, hits, stale, ...).',
+                          lambda: counted(prefetcher), ['event'])
+REGISTRY.gauge('prefetch_queue', 'Prefetch sessions, stored answers and queued sentences.', lambda: uncounted(prefetcher), ['state'])
+REGISTRY.counter_callback('gemini_rate_scheduler_events_total', 'Gemini requests sent at once, queued, timed out or rate limited.',
+                          lambda: counted(backends['gemini'].scheduler), ['event'])
+REGISTRY.gauge('gemini_rate_budget', 'Gemini rate budget available and requests waiting per model.',
+               lambda: uncounted(backends['gemini'].scheduler), ['state'])
+REGISTRY.counter_callback('race_wins_total', 'Races won per backend.',
+                          lambda: {(name,): wins for name, wins in backend_race.stats()['wins'].items()}, ['backend'])
+
+def log_payload(label, text):
+    """Prints a prompt or answer for a sample of requests (LOG_PAYLOAD_SAMPLE_RATE), keeping them off the hot path."""
+    if LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        print(f"--- {label} ---\n{text}")
+
+def read_text_file_cached(path):
+    """Reads a text file, reusing the previous content while its mtime is unchanged."""
+    stat = os.stat(path)
+    mtime = (stat.st_mtime_ns, stat.st_size)
+    cached = text_file_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r', encoding="utf-8") as f:
+            cached = (mtime, f.read())
+        text_file_cache[path] = cached
+    return cached[1]
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    start = g.get('request_start', time.perf_counter())
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if response.is_streamed:
+        # The body has not been generated yet: time its first chunk and, once the server closes it, the whole
+        response.response = timed_stream(response.response, start, endpoint)
+        response.call_on_close(lambda: HTTP_RESPONSE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint))
+    else:
+        elapsed = time.perf_counter() - start
+        HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        HTTP_RESPONSE_SECONDS.observe(elapsed, endpoint=endpoint)
+    return response
+
+def timed_stream(chunks, start, endpoint):
+    """Passes a streamed body through, observing the seconds until its first chunk in HTTP_REQUEST_SECONDS."""
+    first = True
+    for chunk in chunks:
+        if first:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            first = False
+        yield chunk
+    if first:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)  # Empty body
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -22,55 +175,362 @@ def translate_text():
     if not original_sentence:
         return jsonify({'error': 'No sentence provided'}), 400
 
-    # Select the appropriate LLM instance based on user choice
-    if model_choice == 'gemini':
-        llm_instance = GeminiLLM()
-    else:
-        llm_instance = QwenLLM()
+    try:
+        tm_match = find_tm_match(original_sentence)
+        if tm_match is not None and skip_llm_on_match(data):
+            if data.get('session_id') and PREFETCH_LOOKAHEAD > 0:
+                prefetcher.advance(data['session_id'], original_sentence)
+            return jsonify({'alternatives': [tm_match['translation']], 'model': 'tm', 'tm_match': tm_match})
+        prompt = build_prompt_with_context(original_sentence, saved_translations_context)
+        alternatives = take_prefetched(data, original_sentence, model_choice, prompt)
+        if alternatives is not None:
+            return jsonify({'alternatives': alternatives, 'model': model_choice, 'prefetched': True, 'tm_match': tm_match})
+        model_used, alternatives = ask_llm(prompt, model_choice, data.get('refresh', False), data.get('session_id'),
+                                           data.get('parallel'))
+        return jsonify({'alternatives': alternatives, 'model': model_used, 'tm_match': tm_match})
+    except AdmissionError as e:
+        return admission_error_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-    prompt = build_prompt_with_context(original_sentence, saved_translations_context)
+def find_tm_match(original_sentence):
+    """The saved translation of a nearly identical sentence ({original, translation, similarity}), or None."""
+    if FUZZY_MATCH_THRESHOLD <= 0:
+        return None
+    with STAGE_SECONDS.time(stage='tm_match'):
+        return translation_memory.fuzzy_match(original_sentence)
+
+def skip_llm_on_match(data):
+    """Whether a TM match answers the request alone. A refresh always asks the LLM."""
+    return not data.get('refresh', False) and data.get('skip_llm_on_match', FUZZY_MATCH_SKIP_LLM)
+
+def backend_idle(model_choice):
+    """True when no request is running or queued for the backend(s) behind `model_choice`."""
+    names = RACE_BACKENDS if model_choice == 'race' else [model_choice if model_choice in backends else 'qwen']
+    for name in names:
+        stats = admission[name].stats()
+        if stats['in_flight'] or stats['waiting']:
+            return False
+    return True
+
+def take_prefetched(data, original_sentence, model_choice, prompt):
+    """Prefetched alternatives for the request's session, if still valid for `prompt`; moves the lookahead on."""
+    session_id = data.get('session_id')
+    if not session_id or PREFETCH_LOOKAHEAD <= 0:
+        return None
+    alternatives = None
+    if not data.get('refresh', False):
+        alternatives = prefetcher.take(session_id, original_sentence, model_choice, prompt, timeout=REQUEST_DEADLINE)
+    prefetcher.advance(session_id, original_sentence)
+    return alternatives
+
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+    """Loads a session's document for background translation of the sentences ahead.
+
+    Accepts a `sentences` list or a `text` (split on Japanese punctuation) and the
+    `session_id` and `model` later used with /translate. Answers the sentence list.
+    """
+    data = request.get_json()
+    session_id = data.get('session_id')
+    sentences = data.get('sentences') or split_sentences(data.get('text', ''))
+
+    if not session_id or not sentences:
+        return jsonify({'error': 'Missing session_id or sentences'}), 400
+
+    if PREFETCH_LOOKAHEAD > 0:
+        prefetcher.load(session_id, sentences, data.get('model', 'qwen'), int(data.get('position', 0)))
+    return jsonify({'sentences': sentences})
+
+def admission_error_response(e):
+    return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
+def get_llm(model_choice, refresh=False, deadline=None, validator=parse_alternatives, cancelled=None):
+    """Returns the backend for `model_choice` behind its admission queue and the response cache.
+
+    `deadline` (a time.monotonic() value) defaults to REQUEST_DEADLINE from now. Only
+    answers accepted by `validator` are cached. Setting the `cancelled` threading.Event
+    stops the request (see AdmittedLLM).
+    """
+    if model_choice not in backends:
+        model_choice = 'qwen'
+    if deadline is None:
+        deadline = time.monotonic() + REQUEST_DEADLINE
+    llm_instance = AdmittedLLM(backends[model_choice], admission[model_choice], deadline, cancelled)
+    return CachedLLM(llm_instance, response_cache, model_choice, validator=validator, refresh=refresh)
+
+def backend_options(model_choice, session_id=None):
+    """Extra completion arguments for a backend: llama.cpp requests are pinned to the session's slot."""
+    if model_choice == 'qwen':
+        return {'slot_id': slot_for_session(session_id)}
+    return {}
+
+def ask_llm(prompt, model_choice, refresh=False, session_id=None, parallel=None):
+    """Sends the prompt and returns (backend used, 4 alternatives). Raises ValueError on malformed answers.
+
+    With model 'race' the prompt goes to every backend in RACE_BACKENDS and the first
+    answer that parses into four alternatives wins. With `parallel` (default
+    PARALLEL_ALTERNATIVES) Qwen generates each alternative in its own request.
+    """
     print(f"Using model: {model_choice}")
-    print(prompt)
+    log_payload('prompt', prompt)
+    if parallel is None:
+        parallel = PARALLEL_ALTERNATIVES
+
+    if model_choice == 'qwen' and parallel:
+        model_used = 'qwen'
+        alternatives = list(parallel_alternatives(prompt, refresh))
+    elif model_choice == 'race':
+        cancelled = threading.Event()
+        llms = {name: get_llm(name, refresh, cancelled=cancelled) for name in RACE_BACKENDS}
+        model_used, answer, alternatives = backend_race.run(prompt, llms, parse_alternatives, RACE_TIMEOUT, cancelled)
+    else:
+        model_used = model_choice if model_choice in backends else 'qwen'
+        answer = get_llm(model_used, refresh).completion(prompt, **backend_options(model_used, session_id))
+        log_payload('answer', answer)
+        with STAGE_SECONDS.time(stage='json_extraction'):
+            alternatives = parse_alternatives(answer)
+    TRANSLATIONS.inc(model=model_used)
+    return model_used, alternatives
+
+def parallel_alternatives(prompt, refresh=False):
+    """Yields 4 distinct Qwen alternatives as they finish, each from its own concurrent request.
+
+    The requests share the prompt, so they reuse the cached prefix in whichever slots
+    serve them, and differ in seed and sampling preset (ALTERNATIVE_VARIANTS). An answer
+    that repeats an earlier alternative, or does not parse, is regenerated with a new
+    seed, up to PARALLEL_MAX_ATTEMPTS times; after that a repeat is kept rather than
+    failing. Raises ValueError when fewer than 4 alternatives could be produced.
+    """
+    prompt = prompt.rstrip() + '\n\nGive only one translation this time, as a JSON blob: {"translation": "..."}\n'
+    llm = get_llm('qwen', refresh, validator=parse_single_translation)
+    grammar = SINGLE_TRANSLATION_GRAMMAR if backends['qwen'].grammar else None
+
+    def generate(variant, attempt):
+        options = dict(variant, seed=variant['seed'] + 1000 * attempt)
+        return parse_single_translation(llm.completion(prompt, grammar=grammar, **options))
+
+    pending = {alternatives_executor.submit(generate, variant, 0): (variant, 0) for variant in ALTERNATIVE_VARIANTS}
+    seen = set()
+    produced = 0
+    errors = []
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            variant, attempt = pending.pop(future)
+            try:
+                alternative = future.result()
+            except ValueError as e:
+                alternative = None
+                errors.append(str(e))
+            if alternative is not None and (normalize_alternative(alternative) not in seen
+                                            or attempt + 1 >= PARALLEL_MAX_ATTEMPTS):
+                seen.add(normalize_alternative(alternative))
+                produced += 1
+                yield alternative
+            elif attempt + 1 < PARALLEL_MAX_ATTEMPTS:
+                pending[alternatives_executor.submit(generate, variant, attempt + 1)] = (variant, attempt + 1)
+    if produced < len(ALTERNATIVE_VARIANTS):
+        raise ValueError(f"Only {produced} of {len(ALTERNATIVE_VARIANTS)} alternatives could be generated: {errors[-1:]}")
+
+def translate_sentence(original_sentence, model_choice='qwen', saved_translations=None, refresh=False):
+    """Builds the prompt, asks the LLM and returns the 4 alternatives. Raises ValueError on malformed answers."""
+    prompt = build_prompt_with_context(original_sentence, saved_translations or [])
+    return ask_llm(prompt, model_choice, refresh)[1]
+
+def ask_llm_packed(sentences, model_choice, refresh=False, session_id=None):
+    """Sends one packed prompt for `sentences` and returns (backend used, {sentence: 4 alternatives}).
+
+    Sentences the answer left out or garbled are missing from the dict. Raises ValueError
+    when nothing could be parsed.
+    """
+    model_used = model_choice if model_choice in backends else 'qwen'
+    prompt = build_packed_prompt(sentences)
+    print(f"Using model: {model_used} (packed, {len(sentences)} sentences)")
+    log_payload('prompt', prompt)
+
+    options = backend_options(model_used, session_id)
+    if model_used == 'qwen' and backends['qwen'].grammar:
+        options['grammar'] = packed_translations_grammar(len(sentences))
+
+    def complete(answer):
+        if len(parse_packed(answer, sentences)) != len(sentences):
+            raise ValueError('Packed answer is missing sentences')
+
+    answer = get_llm(model_used, refresh, validator=complete).completion(prompt, **options)
+    log_payload('answer', answer)
+    with STAGE_SECONDS.time(stage='json_extraction'):
+        results = parse_packed(answer, sentences)
+    TRANSLATIONS.inc(len(results), model=model_used)
+    return model_used, results
+
+def plan_sentence_packs(sentences, model_choice):
+    """Groups sentences into packs that fit the backend's token limit and PACK_MAX_SENTENCES."""
+    backend = backends.get(model_choice, backends['qwen'])
+    fixed_tokens = estimate_tokens(build_prompt_prefix()) + CONTEXT_TOKEN_BUDGET + 100
+
+    def sentence_tokens(sentence):
+        return (estimate_tokens(sentence) + estimate_answer_tokens(sentence)
+                + estimate_tokens(glossary.for_prompt(sentence)) + 4)
+
+    return plan_packs(sentences, fixed_tokens, backend.context_tokens, PACK_MAX_SENTENCES, sentence_tokens)
+
+def translate_sentences_packed(sentences, model_choice='qwen', refresh=False, session_id=None):
+    """Translates many sentences with packed prompts. Returns (backend used, results, errors), keyed by sentence."""
+    model_used = model_choice if model_choice in backends else 'qwen'
+    results, errors = translate_packed(
+        sentences,
+        lambda pack: ask_llm_packed(pack, model_used, refresh, session_id)[1],
+        lambda pending: plan_sentence_packs(pending, model_used))
+    return model_used, results, errors
+
+@app.route('/translate_packed', methods=['POST'])
+def translate_text_packed():
+    """Translates several sentences with shared prompts.
+
+    Accepts a `sentences` list or a `text` (split on Japanese punctuation). Answers
+    `{results: [{original, alternatives} or {original, error}], model}` in input order.
+    """
+    data = request.get_json()
+    model_choice = data.get('model', 'qwen')
+    sentences = data.get('sentences') or split_sentences(data.get('text', ''))
+
+    if not sentences:
+        return jsonify({'error': 'No sentences provided'}), 400
 
     try:
-        answer = llm_instance.completion(prompt)
-        print(answer)
-        if "```" in answer:
-            answer = "{" + answer.split("```")[1].split("{")[1]
-            alternatives = json.loads(answer)["translations"]
-        else:
-            alternatives = json.loads(answer)["translations"]
-        print(str(alternatives))
-        if not isinstance(alternatives, list) or len(alternatives) != 4:
-            return jsonify({'error': 'LLM did not return the expected format'}), 500
-        return jsonify({'alternatives': alternatives})
+        model_used, results, errors = translate_sentences_packed(sentences, model_choice, data.get('refresh', False),
+                                                                 data.get('session_id'))
+    except AdmissionError as e:
+        return admission_error_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'results': [{'original': sentence, 'alternatives': results[sentence]} if sentence in results
+                    else {'original': sentence, 'error': errors.get(sentence, 'Not translated')}
+                    for sentence in sentences],
+        'model': model_used,
+    })
 
-def build_prompt_with_context(original_sentence, saved_translations):
-    context_str = ""
-    try:
-        if os.path.exists('translations.yaml'):
-            with open('translations.yaml', 'r', encoding="utf-8") as f:
-                translations = yaml.safe_load(f) or []
-                for entry in translations:
-                    context_str += f"Original: {entry.get('original', '')}\n"
-                    context_str += f"Translation: {entry.get('translation', '')}\n\n"
-    except Exception as e:
-        print(f"Error reading translations.yaml: {e}")
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route('/translate/stream', methods=['POST'])
+def translate_text_stream():
+    """Server-sent events version of /translate.
+
+    Sends a `tm_match` event first when the translation memory holds a nearly
+    identical sentence. While the backend streams, each raw piece of its answer is
+    forwarded as a `token` event ({text}), and an `alternative` event ({index, text})
+    follows as soon as each entry of the `translations` array is complete. Then
+    `done` with all four alternatives, or `error`. When the TM match is enough,
+    `done` follows it directly. Race and parallel generation produce no `token` events.
+    """
+    data = request.get_json()
+    original_sentence = data.get('original_sentence')
+    saved_translations_context = data.get('saved_translations', [])
+    model_choice = data.get('model', 'qwen')
+
+    if not original_sentence:
+        return jsonify({'error': 'No sentence provided'}), 400
+
+    tm_match = find_tm_match(original_sentence)
+    tm_events = [sse_event('tm_match', tm_match)] if tm_match is not None else []
+    if tm_match is not None and skip_llm_on_match(data):
+        if data.get('session_id') and PREFETCH_LOOKAHEAD > 0:
+            prefetcher.advance(data['session_id'], original_sentence)
+        tm_events.append(sse_event('done', {'alternatives': [tm_match['translation']], 'model': 'tm'}))
+        observe_first_alternative('tm')
+        return Response(''.join(tm_events), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    prompt = build_prompt_with_context(original_sentence, saved_translations_context)
+    prefetched = take_prefetched(data, original_sentence, model_choice, prompt)
+    if prefetched is not None:
+        events = tm_events + [sse_event('alternative', {'index': index, 'text': alternative})
+                              for index, alternative in enumerate(prefetched)]
+        events.append(sse_event('done', {'alternatives': prefetched, 'model': model_choice, 'prefetched': True}))
+        observe_first_alternative(model_choice)
+        return Response(''.join(events), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-    with open('glossary.txt', 'r', encoding="utf-8") as f:
-        glossary = f.read()
+    llm_instance = get_llm(model_choice, data.get('refresh', False))
+    controller = admission.get(llm_instance.model_name)
+    if model_choice != 'race' and controller.is_full():
+        return admission_error_response(QueueFull(f"{controller.name} is busy", controller.retry_after()))
 
+    print(f"Using model: {model_choice} (streaming)")
+    start = g.request_start
+
+    def generate():
+        yield from tm_events
+        parser = TranslationsStreamParser()
+        answer = ""
+        try:
+            if model_choice == 'race':
+                # Racing needs whole answers to validate, so the winner's alternatives are sent at once
+                model_used, alternatives = ask_llm(prompt, model_choice, data.get('refresh', False), data.get('session_id'))
+                for index, alternative in enumerate(alternatives):
+                    yield sse_event('alternative', {'index': index, 'text': alternative})
+                yield sse_event('done', {'alternatives': alternatives, 'model': model_used})
+                return
+            if model_choice == 'qwen' and data.get('parallel', PARALLEL_ALTERNATIVES):
+                alternatives = []
+                for alternative in parallel_alternatives(prompt, data.get('refresh', False)):
+                    alternatives.append(alternative)
+                    yield sse_event('alternative', {'index': len(alternatives) - 1, 'text': alternative})
+                TRANSLATIONS.inc(model='qwen')
+                yield sse_event('done', {'alternatives': alternatives, 'model': 'qwen'})
+                return
+            for piece in llm_instance.completion_stream(prompt, **backend_options(llm_instance.model_name, data.get('session_id'))):
+                answer += piece
+                yield sse_event('token', {'text': piece})
+                for alternative in parser.feed(piece):
+                    yield sse_event('alternative', {'index': len(parser.alternatives) - 1, 'text': alternative})
+            try:
+                alternatives = parse_alternatives(answer)
+            except ValueError:
+                alternatives = parser.alternatives
+            if len(alternatives) != 4:
+                yield sse_event('error', {'error': 'LLM did not return the expected format'})
+                return
+            TRANSLATIONS.inc(model=llm_instance.model_name)
+            yield sse_event('done', {'alternatives': alternatives, 'model': llm_instance.model_name})
+        except AdmissionError as e:
+            yield sse_event('error', {'error': str(e), 'retry_after': e.retry_after})
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+
+    def timed_events():
+        first = True
+        for event in generate():
+            if first and event.startswith('event: alternative'):
+                observe_first_alternative(model_choice, start)
+                first = False
+            yield event
+
+    return Response(timed_events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def observe_first_alternative(model_choice, start=None):
+    """Records how long the user waited for the first alternative of /translate/stream."""
+    if start is None:
+        start = g.request_start
+    FIRST_ALTERNATIVE_SECONDS.observe(time.perf_counter() - start, model=model_choice)
+
+def build_prompt_prefix():
+    """The part of every prompt that only changes when the user edits their prompt.
+
+    It comes first so the llama.cpp server can reuse the KV cache of this prefix
+    across requests; per-sentence segments follow from most to least stable.
+    """
     try:
-        with open('user_prompt.txt', 'r', encoding="utf-8") as f:
-            user_editable_prompt = f.read().strip()
+        user_editable_prompt = read_text_file_cached('user_prompt.txt').strip()
     except FileNotFoundError:
         user_editable_prompt = """Traduza a frase abaixo de 4 formas diferentes considerando as nuances possíveis e as diferenças de interpretação semântica."""
 
-    prompt = f"""{context_str}{glossary}{user_editable_prompt} Utilize um JSON blob dentro de um code block como no exemplo abaixo:
-```    
-{{
+    # The JSON grammar only allows the bare JSON, so with it on the example is shown without the ``` fence
+    fence = "" if QWEN_JSON_GRAMMAR else "```\n"
+    instruction = "Responda somente com um JSON blob" if QWEN_JSON_GRAMMAR else "Utilize um JSON blob dentro de um code block"
+    return f"""{user_editable_prompt} {instruction} como no exemplo abaixo:
+{fence}{{
   "original_phrase": "堀川の大殿様のやうな方は、これまでは固より、後の世には恐らく二人とはいらつしやいますまい。",
   "translations": [
       "Uma pessoa como o senhor feudal de Horikawa, claro que até hoje nunca houve igual, e no futuro, provavelmente, não haverá sequer mais um como ele.",
@@ -79,11 +539,112 @@ def build_prompt_with_context(original_sentence, saved_translations):
       "Homens como o nobre de Horikawa — já únicos até agora — jamais dividirão este mundo com um igual em tempos vindouros."
   ]
 }}
-```
-\n\nTranslate the following sentence: {original_sentence}\n\n
+{fence}\n\n"""
+
+def format_examples(examples):
+    """Saved translations as few-shot examples, up to CONTEXT_TOKEN_BUDGET estimated tokens."""
+    context_str = ""
+    context_tokens = 0
+    for entry in examples:
+        example = f"Original: {entry['original']}\nTranslation: {entry['translation']}\n\n"
+        context_tokens += estimate_tokens(example)
+        if context_tokens > CONTEXT_TOKEN_BUDGET:
+            break
+        context_str += example
+    return context_str
+
+def build_prompt_with_context(original_sentence, saved_translations):
+    with STAGE_SECONDS.time(stage='context_load'):
+        examples = translation_memory.search(original_sentence, CONTEXT_TOP_K)
+        glossary_str = glossary.for_prompt(original_sentence)
+
+    with STAGE_SECONDS.time(stage='prompt_build'):
+        context_str = format_examples(examples)
+
+        # Most stable first: instructions, then glossary entries, then the saved examples, then the sentence
+        prompt = f"""{build_prompt_prefix()}{glossary_str}{context_str}Translate the following sentence: {original_sentence}\n\n
 """
     return prompt
 
+def build_packed_prompt(sentences):
+    """Prompt asking for one translation object per sentence, sharing the prefix, glossary and examples.
+
+    Glossary lines and examples are merged over the sentences; examples are taken round-robin
+    from each sentence's best matches so every sentence gets some within the token budget.
+    """
+    with STAGE_SECONDS.time(stage='context_load'):
+        glossary_lines = []
+        for sentence in sentences:
+            glossary_lines.extend(glossary.matching_lines(sentence))
+        matches = [translation_memory.search(sentence, CONTEXT_TOP_K) for sentence in sentences]
+
+    with STAGE_SECONDS.time(stage='prompt_build'):
+        glossary_str = ''.join(line + '\n' for line in dict.fromkeys(glossary_lines))
+        examples = {}
+        for rank in range(CONTEXT_TOP_K):
+            for sentence_matches in matches:
+                if rank < len(sentence_matches):
+                    examples.setdefault(sentence_matches[rank]['original'], sentence_matches[rank])
+        context_str = format_examples(examples.values())
+        numbered = ''.join(f"{i}. {sentence}\n" for i, sentence in enumerate(sentences, 1))
+        prompt = f"""{build_prompt_prefix()}{glossary_str}{context_str}Translate each of the following {len(sentences)} sentences. Answer with a JSON array holding one object like the example above per sentence, in the same order, with the sentence copied unchanged into "original_phrase":
+{numbered}\n
+"""
+    return prompt
+
+def slot_for_session(session_id):
+    """Pins a session to one llama.cpp slot so its requests hit a warm KV cache (-1: let the server choose)."""
+    if not session_id or QWEN_SLOTS <= 0:
+        return -1
+    return zlib.crc32(str(session_id).encode("utf-8")) % QWEN_SLOTS
+
+def batch_concurrency(requested, model_choice):
+    """`requested` capped at BATCH_MAX_CONCURRENCY and at what the backend's admission queue holds,
+    so a batch on its own cannot get its sentences turned away with QueueFull."""
+    controller = admission.get(model_choice, admission['qwen'])
+    return max(1, min(requested, BATCH_MAX_CONCURRENCY, controller.max_in_flight + controller.max_queue))
+
+def warm_up_qwen():
+    """Evaluates the static prompt prefix into every llama.cpp slot, so the first requests start warm."""
+    prefix = build_prompt_prefix()
+    for slot_id in range(max(QWEN_SLOTS, 1)):
+        try:
+            result = backends['qwen'].warm_up(prefix, slot_id if QWEN_SLOTS > 0 else -1)
+            print(f"Warmed up llama.cpp slot {result.get('id_slot', slot_id)} with {result.get('tokens_evaluated')} prompt tokens")
+        except Exception as e:
+            print(f"Could not warm up llama.cpp slot {slot_id}: {e}")
+            break
+
+@app.route('/translate_batch', methods=['POST'])
+def translate_batch():
+    """Translates a whole document and streams one JSON line per sentence as each one finishes.
+
+    Accepts either `text` (split on Japanese punctuation) or a `sentences` list. Sentences in
+    `skip` or already saved in the translation memory are not sent to the LLM. With `pack`
+    the sentences are sent several per prompt (see /translate_packed).
+    """
+    data = request.get_json()
+    model_choice = data.get('model', 'qwen')
+    concurrency = batch_concurrency(int(data.get('concurrency', 4)), model_choice)
+    sentences = data.get('sentences') or split_sentences(data.get('text', ''))
+
+    if not sentences:
+        return jsonify({'error': 'No text provided'}), 400
+
+    def generate():
+        if data.get('pack'):
+            results = translate_document_packed(
+                sentences, lambda pending: plan_sentence_packs(pending, model_choice),
+                lambda pack: translate_sentences_packed(pack, model_choice)[1:],
+                translation_memory, set(data.get('skip', [])), concurrency)
+        else:
+            results = translate_document(sentences, lambda sentence: translate_sentence(sentence, model_choice),
+                                         translation_memory, set(data.get('skip', [])), concurrency)
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/save_translation', methods=['POST'])
 def save_translation():
     data = request.get_json()
@@ -94,32 +655,9 @@ def save_translation():
         return jsonify({'error': 'Missing data'}), 400
 
     try:
-        translations = []
-        if os.path.exists('translations.yaml'):
-            with open('translations.yaml', 'r', encoding="utf-8") as f:
-                translations = yaml.safe_load(f) or []
-
-        # Check if the translation already exists
-        existing_entry = None
-        for entry in translations:
-            if entry.get('original') == original_sentence:
-                existing_entry = entry
-                break
-
-        if existing_entry:
-            # Update the existing entry
-            existing_entry['translation'] = translation
-        else:
-            # Add a new entry
-            new_entry = {
-                'original': original_sentence,
-                'translation': translation
-            }
-            translations.append(new_entry)
-
-        with open('translations.yaml', 'w', encoding="utf-8") as f:
-            yaml.dump(translations, f, default_flow_style=False, allow_unicode=True)
-
+        # Updates the existing entry or adds a new one
+        translation_memory.upsert(original_sentence, translation)
+        prefetcher.invalidate()  # The new example may change other sentences' prompts
         return jsonify({'success': 'Translation saved successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -148,16 +686,76 @@ def get_prompt():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats()), 200
+
+@app.route('/qwen_stats', methods=['GET'])
+def qwen_stats():
+    """llama.cpp prompt cache reuse, from the `timings` the server returns with each completion."""
+    return jsonify(backends['qwen'].cache_stats()), 200
+
+@app.route('/admission_stats', methods=['GET'])
+def admission_stats():
+    return jsonify({name: controller.stats() for name, controller in admission.items()}), 200
+
+@app.route('/race_stats', methods=['GET'])
+def race_stats():
+    return jsonify(backend_race.stats()), 200
+
 @app.route('/get_translations', methods=['GET'])
 def get_translations():
+    """Saved translations, optionally paged, filtered and limited to recent changes.
+
+    Without parameters every entry is returned. `limit` pages through the entries in
+    change order: pass the returned `next_cursor` as `cursor` for the next page (it is
+    null on the last one). `q` keeps entries whose original or translation contains it.
+    `since` takes the `version` of an earlier response and returns only entries added
+    or changed after it; `reset` is true when that version is no longer comparable
+    (the file was reloaded) and everything is sent again. The ETag follows the
+    version, so If-None-Match gets a 304 while nothing changed.
+    """
     try:
-        translations = []
-        if os.path.exists('translations.yaml'):
-            with open('translations.yaml', 'r', encoding="utf-8") as f:
-                translations = yaml.safe_load(f) or []
-        return jsonify({'translations': translations}), 200
+        etag = f"{translation_memory.generation}-{translation_memory.version}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        limit = request.args.get('limit', type=int)
+        token = request.args.get('cursor') or request.args.get('since')
+        query = request.args.get('q') or None
+        generation, version = translation_memory.generation, 0
+        reset = False
+        if token:
+            token_generation, _, token_version = token.partition(':')
+            if token_generation == generation and token_version.isdigit():
+                version = int(token_version)
+            else:
+                reset = True
+        if limit is not None:
+            limit = max(1, min(limit, TRANSLATIONS_PAGE_MAX))
+
+        translations, last = translation_memory.changes_since(version, limit, query)
+        response = jsonify({
+            'translations': translations,
+            'next_cursor': f"{generation}:{last}" if limit is not None and len(translations) >= limit else None,
+            'version': f"{generation}:{last}",
+            'reset': reset,
+        })
+        response.set_etag(f"{generation}-{last}" if limit is None else etag)
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+prefetcher = Prefetcher(
+    build_prompt=lambda sentence: build_prompt_with_context(sentence, []),
+    translate=lambda prompt, model_choice: ask_llm(prompt, model_choice)[1],
+    is_idle=backend_idle,
+    lookahead=PREFETCH_LOOKAHEAD,
+)
+
 if __name__ == '__main__':
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':  # Only in the reloader's serving process
+        threading.Thread(target=warm_up_qwen, daemon=True).start()
     app.run(debug=True, port=5002)
@@ -0,0 +1,166 @@
+"""Batch translation of whole documents such as `source.txt`.
+
+Splits the text into sentences, translates them concurrently with the configured
+backend and writes one JSON object per line:
+
+    python batch_translate.py source.txt --model qwen --concurrency 4 --output source.jsonl
+
+With `--pack`, several sentences share each prompt (see `packing.py`).
+
+Re-running with the same `--output` resumes: sentences already translated there,
+or already saved in the translation memory, are not sent to the LLM again.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SENTENCE_ENDINGS = '。！？'
+QUOTE_OPEN = '「'
+QUOTE_CLOSE = '」'
+
+
+def split_sentences(text):
+    """Splits Japanese text on 。！？ and on closing 」 of top-level quotes; line breaks also end a sentence."""
+    sentences = []
+    current = ''
+    depth = 0
+    for char in text:
+        if char == '\n':
+            sentences.append(current)
+            current = ''
+            depth = 0
+            continue
+        current += char
+        if char == QUOTE_OPEN:
+            depth += 1
+        elif char == QUOTE_CLOSE:
+            depth = max(depth - 1, 0)
+            if depth == 0:
+                sentences.append(current)
+                current = ''
+        elif char in SENTENCE_ENDINGS and depth == 0:
+            sentences.append(current)
+            current = ''
+    sentences.append(current)
+    return [sentence.strip().strip('　') for sentence in sentences if sentence.strip().strip('　')]
+
+
+def load_done(output_path):
+    """Originals already translated in a previous run's JSONL output."""
+    done = set()
+    if output_path and os.path.exists(output_path):
+        with open(output_path, 'r', encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by an interrupted run
+                if record.get('alternatives'):
+                    done.add(record['original'])
+    return done
+
+
+def translate_document(sentences, translate, memory=None, done=(), concurrency=4):
+    """Yields one result dict per sentence, in completion order.
+
+    `translate(sentence)` returns the alternatives. Sentences in `done` are skipped
+    and sentences saved in `memory` are answered from it without calling the LLM.
+    """
+    def run(index, sentence):
+        try:
+            return {'index': index, 'original': sentence, 'alternatives': translate(sentence), 'source': 'llm'}
+        except Exception as e:
+            return {'index': index, 'original': sentence, 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = []
+        for index, sentence in enumerate(sentences):
+            if sentence in done:
+                continue
+            saved = memory.get(sentence) if memory is not None else None
+            if saved is not None:
+                yield {'index': index, 'original': sentence, 'alternatives': [saved], 'source': 'memory'}
+                continue
+            futures.append(executor.submit(run, index, sentence))
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def translate_document_packed(sentences, plan, translate_many, memory=None, done=(), concurrency=4):
+    """Like `translate_document`, but sends the sentences in packs.
+
+    `plan(sentences)` splits the sentences to translate into packs and
+    `translate_many(pack)` returns (results, errors) dicts keyed by sentence.
+    """
+    pending = {}  # sentence -> indexes in the document
+    for index, sentence in enumerate(sentences):
+        if sentence in done:
+            continue
+        saved = memory.get(sentence) if memory is not None else None
+        if saved is not None:
+            yield {'index': index, 'original': sentence, 'alternatives': [saved], 'source': 'memory'}
+            continue
+        pending.setdefault(sentence, []).append(index)
+
+    def run(pack):
+        try:
+            return translate_many(pack)
+        except Exception as e:
+            return {}, {sentence: str(e) for sentence in pack}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(run, pack): pack for pack in plan(list(pending))}
+        for future in as_completed(futures):
+            results, errors = future.result()
+            for sentence in futures[future]:
+                for index in pending[sentence]:
+                    if sentence in results:
+                        yield {'index': index, 'original': sentence, 'alternatives': results[sentence], 'source': 'llm'}
+                    else:
+                        yield {'index': index, 'original': sentence, 'error': errors.get(sentence, 'Not translated')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Translate a whole document sentence by sentence.")
+    parser.add_argument('document', help="UTF-8 text file to translate")
+    parser.add_argument('--model', default='qwen', choices=['qwen', 'gemini'])
+    parser.add_argument('--concurrency', type=int, default=4, help="Max sentences in flight at once (capped at BATCH_MAX_CONCURRENCY)")
+    parser.add_argument('--output', help="JSONL file to append results to (also used to resume)")
+    parser.add_argument('--pack', action='store_true', help="Send several sentences per prompt")
+    args = parser.parse_args(argv)
+
+    from app import batch_concurrency, plan_sentence_packs, translate_sentence, translate_sentences_packed, translation_memory
+
+    with open(args.document, 'r', encoding="utf-8") as f:
+        sentences = split_sentences(f.read())
+    done = load_done(args.output)
+    print(f"{len(sentences)} sentences, {len(done)} already done", file=sys.stderr)
+    concurrency = batch_concurrency(args.concurrency, args.model)
+    if concurrency < args.concurrency:
+        print(f"Concurrency lowered to {concurrency} (BATCH_MAX_CONCURRENCY and the {args.model} queue)", file=sys.stderr)
+
+    out = open(args.output, 'a', encoding="utf-8") if args.output else sys.stdout
+    try:
+        # Keep the backend's progress prints out of the JSONL stream
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.pack:
+                results = translate_document_packed(
+                    sentences, lambda pending: plan_sentence_packs(pending, args.model),
+                    lambda pack: translate_sentences_packed(pack, args.model)[1:],
+                    translation_memory, done, concurrency)
+            else:
+                results = translate_document(sentences, lambda s: translate_sentence(s, args.model),
+                                             translation_memory, done, concurrency)
+            for result in results:
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Fuzzy translation memory lookup cost against memory size.
+
+Fills a `FuzzyIndex` with sentences from `source.txt` plus synthetic sentences
+(words drawn with Zipf-like frequencies from a random kanji/kana vocabulary, with
+common particles between them) and times `best_match` for
+queries that are exact hits, near hits (one character changed, furigana added)
+and misses. Compares with scoring every saved sentence.
+
+    python benchmarks/bench_fuzzy_match.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from context_index import char_ngrams
+from fuzzy_match import FuzzyIndex, normalize
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SIZES = [100, 1000, 10000, 100000]
+QUERIES = 300
+KANA = [chr(code) for code in range(0x3041, 0x3094)]
+PARTICLES = ['は', 'が', 'を', 'に', 'で', 'と', 'の', 'も', 'へ', 'から', 'まで', 'ました', 'です', 'ている']
+
+
+def load_sentences():
+    with open(os.path.join(ROOT, 'source.txt'), 'r', encoding="utf-8") as f:
+        text = f.read()
+    return [s.strip() for s in text.replace('\n', '。').split('。') if len(s.strip()) > 5]
+
+
+def vocabulary(rng, size=20000):
+    kanji = [chr(rng.randint(0x4e00, 0x6fff)) for _ in range(3000)]
+    words = []
+    for _ in range(size):
+        if rng.random() < 0.7:
+            words.append(''.join(rng.choice(kanji) for _ in range(rng.randint(1, 3))))
+        else:
+            words.append(''.join(rng.choice(KANA) for _ in range(rng.randint(2, 4))))
+    weights = [1 / (rank + 1) for rank in range(size)]
+    return words, weights
+
+
+def synthetic_sentence(words, weights, rng):
+    count = rng.randint(3, 10)
+    chosen = rng.choices(words, weights, k=count)
+    return ''.join(word + rng.choice(PARTICLES) for word in chosen) + '。'
+
+
+def near_variant(sentence, rng):
+    chars = list(sentence)
+    if rng.random() < 0.5:
+        chars[rng.randrange(len(chars))] = rng.choice(KANA)
+    else:
+        position = rng.randrange(len(chars))
+        chars.insert(position + 1, '（' + ''.join(rng.choice(KANA) for _ in range(2)) + '）')
+    return ''.join(chars)
+
+
+def brute_force(docs, query, threshold):
+    normalized = normalize(query)
+    query_set = set(char_ngrams(normalized))
+    best = None
+    for doc_id, doc_set in docs.items():
+        similarity = 2 * len(query_set & doc_set) / (len(query_set) + len(doc_set) or 1)
+        if similarity >= threshold and (best is None or similarity > best[1]):
+            best = (doc_id, similarity)
+    return best
+
+
+def main():
+    rng = random.Random(0)
+    sentences = load_sentences()
+    words, weights = vocabulary(rng)
+    print(f"{'entries':>8} {'build ms':>10} {'exact us':>10} {'near us':>10} {'miss us':>10} "
+          f"{'brute us':>10} {'near found':>11} {'agree':>7}")
+    for size in SIZES:
+        originals = list(dict.fromkeys(sentences))[:size]
+        while len(originals) < size:
+            originals.append(synthetic_sentence(words, weights, rng))
+        originals = list(dict.fromkeys(originals))
+
+        index = FuzzyIndex()
+        start = time.perf_counter()
+        index.build((original, original) for original in originals)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        picked = rng.sample(originals, min(QUERIES, len(originals)))
+        near = [near_variant(original, rng) for original in picked]
+        misses = [synthetic_sentence(words, weights, rng) for _ in picked]
+        timings = []
+        for queries in (picked, near, misses):
+            start = time.perf_counter()
+            for query in queries:
+                index.best_match(query)
+            timings.append((time.perf_counter() - start) / len(queries) * 1e6)
+        near_found = sum(match is not None for match in [index.best_match(query) for query in near])
+
+        docs = {original: set(char_ngrams(normalize(original))) for original in originals}
+        checked = near[:20]
+        start = time.perf_counter()
+        expected = [brute_force(docs, query, index.threshold) for query in checked]
+        brute_us = (time.perf_counter() - start) / len(checked) * 1e6
+        agree = sum((a is None) == (b is None) and (a is None or abs(a[1] - b[1]) < 1e-9)
+                    for a, b in zip(expected, [index.best_match(query) for query in checked]))
+
+        print(f"{len(originals):>8} {build_ms:>10.1f} {timings[0]:>10.1f} {timings[1]:>10.1f} {timings[2]:>10.1f} "
+              f"{brute_us:>10.1f} {near_found:>7}/{len(near):<3} {agree:>4}/{len(checked)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Per-request glossary matching cost against glossary size.
+
+Compares the Aho-Corasick matcher in `glossary.py` with a naive `term in sentence`
+scan over every term, using sentences from `source.txt` and synthetic glossaries
+made of random kanji terms plus some real substrings of the text.
+
+    python benchmarks/bench_glossary.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from glossary import Glossary
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SIZES = [100, 1000, 10000, 100000]
+
+
+def load_sentences():
+    with open(os.path.join(ROOT, 'source.txt'), 'r', encoding="utf-8") as f:
+        text = f.read()
+    return [s.strip() for s in text.replace('\n', '。').split('。') if len(s.strip()) > 5]
+
+
+def synthetic_glossary(text, size, rng):
+    terms = set()
+    for _ in range(min(size // 10, 500)):
+        start = rng.randrange(len(text) - 6)
+        terms.add(text[start:start + rng.randint(2, 4)])
+    while len(terms) < size:
+        terms.add(''.join(chr(rng.randint(0x4e00, 0x9fff)) for _ in range(rng.randint(2, 4))))
+    return '\n'.join(f"{term} - tradução {i}" for i, term in enumerate(terms))
+
+
+def main():
+    rng = random.Random(0)
+    sentences = load_sentences()
+    text = ''.join(sentences)
+    print(f"{'terms':>8} {'build ms':>10} {'aho-corasick us/req':>20} {'naive us/req':>14} {'avg matches':>12}")
+    for size in SIZES:
+        content = synthetic_glossary(text, size, rng)
+        glossary = Glossary()
+        start = time.perf_counter()
+        glossary.parse(content)
+        build_ms = (time.perf_counter() - start) * 1000
+        always_lines, lines, matcher = glossary.parsed
+        terms = [line.split(Glossary.SEPARATOR, 1)[0] for line in lines]
+
+        start = time.perf_counter()
+        matches = sum(len(matcher.find(sentence)) for sentence in sentences)
+        ac_us = (time.perf_counter() - start) / len(sentences) * 1e6
+
+        start = time.perf_counter()
+        for sentence in sentences:
+            [term for term in terms if term in sentence]
+        naive_us = (time.perf_counter() - start) / len(sentences) * 1e6
+
+        print(f"{size:>8} {build_ms:>10.1f} {ac_us:>20.1f} {naive_us:>14.1f} {matches / len(sentences):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Per-request overhead of the Qwen backend with and without connection pooling.
+
+Runs against a local llama.cpp stub (no generation latency), so the numbers are the
+client/transport overhead alone:
+
+- `requests.post` per call (the old behaviour: a new TCP connection every time)
+- `QwenLLM.completion` over the pooled session
+- `QwenLLM.acompletion` with many requests in flight on one event loop
+
+    python benchmarks/bench_qwen_pooling.py [requests]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from qwen_local import LLM as QwenLLM
+from stubs import LlamaStubServer
+
+PROMPT = "Translate the following sentence: 堀川の大殿様のやうな方は"
+
+
+def bench_unpooled(llm, count):
+    data = json.dumps(llm.request_data(PROMPT))
+    start = time.perf_counter()
+    for _ in range(count):
+        requests.post(llm.url + '/completion', headers={"Content-Type": "application/json"}, data=data).json()
+    return time.perf_counter() - start
+
+
+def bench_pooled(llm, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        llm.completion(PROMPT)
+    return time.perf_counter() - start
+
+
+def bench_async(llm, count, in_flight=16):
+    async def run():
+        semaphore = asyncio.Semaphore(in_flight)
+
+        async def one():
+            async with semaphore:
+                await llm.acompletion(PROMPT)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(count)))
+        elapsed = time.perf_counter() - start
+        await llm.aclose()
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def report(name, stub, elapsed, count, connections_before):
+    print(f"{name:<28} {elapsed / count * 1000:>8.3f} ms/req {count / elapsed:>9.1f} req/s "
+          f"{len(stub.connections) - connections_before:>6} connections")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with LlamaStubServer() as stub:
+        llm = QwenLLM(url=stub.url)
+        llm.completion(PROMPT)  # Warm up
+        for name, bench in [('requests.post (no pool)', bench_unpooled), ('completion (pooled)', bench_pooled)]:
+            before = len(stub.connections)
+            report(name, stub, bench(llm, count), count, before)
+        try:
+            before = len(stub.connections)
+            report('acompletion (16 in flight)', stub, bench_async(llm, count), count, before)
+        except ImportError:
+            print("acompletion skipped: aiohttp is not installed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""End-to-end load test of the HTTP API against local backend stubs.
+
+For each translation-store size, builds a scratch working directory with a
+synthetic `translations.yaml` (sentences from `source.txt`), starts `serve.py`
+there with the backend pointed at a local stub (see `stubs.py`), and drives
+`/translate`, `/save_translation` and `/get_translations` at a fixed concurrency.
+Reports p50/p95/p99 latency, throughput, error counts, startup time and the
+server's resident memory, so runs can be compared before and after a change:
+
+    python benchmarks/load_test.py --sizes 100,1000,10000,100000 --concurrency 8 --requests 200
+    python benchmarks/load_test.py --backend gemini --latency 0.5 --tokens-per-second 50 --rate-limit-rate 0.05
+    python benchmarks/load_test.py --json before.json
+
+The response cache is disabled unless `--cache` is given, so every `/translate`
+reaches the stub.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from batch_translate import split_sentences
+from stubs import GeminiStubServer, LlamaStubServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ENDPOINTS = ['translate', 'save_translation', 'get_translations']
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+def load_sentences():
+    with open(os.path.join(ROOT, 'source.txt'), 'r', encoding="utf-8") as f:
+        return split_sentences(f.read())
+
+
+def synthetic_store(sentences, size, rng):
+    """`size` distinct entries made from real sentences, numbered so they do not collide."""
+    return [{'original': f"{rng.choice(sentences)}（{i}）", 'translation': f"Tradução sintética número {i}."}
+            for i in range(size)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def memory_kb(pid):
+    """(VmRSS, VmHWM) of the process in kB from /proc, or (None, None) where that is unavailable."""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in ('VmRSS', 'VmHWM'):
+                    values[name] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class AppServer:
+    """serve.py running in a scratch directory holding the given translation store."""
+
+    def __init__(self, store, env, threads=32):
+        self.workdir = tempfile.mkdtemp(prefix='load_test_')
+        for name in ('glossary.txt', 'user_prompt.txt'):
+            shutil.copy(os.path.join(ROOT, name), self.workdir)
+        with open(os.path.join(self.workdir, 'translations.yaml'), 'w', encoding="utf-8") as f:
+            yaml.dump(store, f, Dumper=YAML_DUMPER, allow_unicode=True, sort_keys=False)
+        with open(os.path.join(self.workdir, '.env'), 'w') as f:
+            f.write("GOOGLE_API_KEY=load-test\n")
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT), **env)
+        self.threads = threads
+        self.process = None
+        self.log = None
+
+    def start(self, timeout=600):
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'w')
+        start = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.abspath(ROOT), 'serve.py'), '--port', str(self.port),
+             '--threads', str(self.threads), '--no-warm-up'],
+            cwd=self.workdir, env=self.env, stdout=self.log, stderr=subprocess.STDOUT)
+        while time.perf_counter() - start < timeout:
+            if self.process.poll() is not None:
+                self.log.flush()
+                with open(self.log.name, 'r', encoding="utf-8", errors='replace') as f:
+                    raise RuntimeError(f"Server exited with {self.process.returncode}:\n{f.read()[-2000:]}")
+            try:
+                requests.get(self.url + '/get_prompt', timeout=1)
+                return time.perf_counter() - start
+            except requests.ConnectionError:
+                time.sleep(0.05)
+        raise RuntimeError("Server did not start in time")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+        if self.log is not None:
+            self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_phase(url, endpoint, count, concurrency, sentences, model, rng):
+    """Sends `count` requests to one endpoint from `concurrency` threads. Returns latencies and status counts."""
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        sentence = sentences[i % len(sentences)]
+        start = time.perf_counter()
+        if endpoint == 'translate':
+            response = session.post(url + '/translate', json={'original_sentence': sentence, 'model': model,
+                                                              'session_id': f'load-{i % concurrency}'})
+        elif endpoint == 'save_translation':
+            response = session.post(url + '/save_translation', json={
+                'original_sentence': sentence, 'translation': f"Tradução salva {rng.random():.6f}."})
+        else:
+            response = session.get(url + '/get_translations')
+        response.content
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, status in results if status == 200)
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'requests': count,
+        'ok': len(latencies),
+        'statuses': statuses,
+        'seconds': elapsed,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the translation API against local backend stubs.")
+    parser.add_argument('--sizes', default='100,1000,10000,100000', help="Comma-separated translation store sizes")
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads per phase")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and store size")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help="Comma-separated subset of " + ', '.join(ENDPOINTS))
+    parser.add_argument('--backend', default='qwen', choices=['qwen', 'gemini'])
+    parser.add_argument('--latency', type=float, default=0.05, help="Stub seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="Stub generation speed (0: instant)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of stub answers that are 500s")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of stub answers that are 429s")
+    parser.add_argument('--threads', type=int, default=32, help="Server worker threads")
+    parser.add_argument('--cache', action='store_true', help="Keep the response cache enabled")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    sentences = load_sentences()
+    endpoints = [e for e in args.endpoints.split(',') if e]
+    stub_settings = dict(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                         error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    results = []
+
+    with LlamaStubServer(**stub_settings) as llama, GeminiStubServer(**stub_settings) as gemini:
+        env = {
+            'QWEN_URL': llama.url,
+            'GEMINI_API_ENDPOINT': gemini.url,
+            'QWEN_MAX_IN_FLIGHT': str(args.concurrency),
+            'GEMINI_MAX_IN_FLIGHT': str(args.concurrency),
+        }
+        if not args.cache:
+            env['RESPONSE_CACHE_SIZE'] = '0'
+
+        print(f"{'store':>7} {'endpoint':<17} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'errors':>6} {'RSS MB':>7} {'peak MB':>7}")
+        for size in [int(s) for s in args.sizes.split(',') if s]:
+            server = AppServer(synthetic_store(sentences, size, rng), env, args.threads)
+            try:
+                startup = server.start()
+                rss, _ = memory_kb(server.process.pid)
+                print(f"{size:>7} {'(startup)':<17} {'':>8} {startup * 1000:>8.0f} {'':>8} {'':>8} {'':>6} "
+                      f"{(rss or 0) / 1024:>7.1f} {'':>7}")
+                for endpoint in endpoints:
+                    result = run_phase(server.url, endpoint, args.requests, args.concurrency, sentences,
+                                       args.backend, rng)
+                    rss, peak = memory_kb(server.process.pid)
+                    result.update(store_size=size, endpoint=endpoint, startup_seconds=startup,
+                                  rss_kb=rss, peak_rss_kb=peak)
+                    results.append(result)
+                    print(f"{size:>7} {endpoint:<17} {result['throughput']:>8.1f} {result['p50_ms']:>8.1f} "
+                          f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['requests'] - result['ok']:>6} "
+                          f"{(rss or 0) / 1024:>7.1f} {(peak or 0) / 1024:>7.1f}")
+            finally:
+                server.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding="utf-8") as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
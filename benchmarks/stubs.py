@@ -0,0 +1,262 @@
+"""Local stand-ins for the LLM backends, for benchmarks.
+
+`LlamaStubServer` answers llama.cpp `/completion` requests (plain or streamed)
+with a canned translation JSON after a configurable latency and token rate, and
+can inject errors. It speaks HTTP/1.1 keep-alive, like the real server.
+
+    with LlamaStubServer(latency=0.05) as stub:
+        QwenLLM(url=stub.url).completion("...")
+
+`GeminiStubServer` does the same for the Gemini REST API (`generateContent`,
+`streamGenerateContent`, `countTokens`), including 429 RESOURCE_EXHAUSTED
+injection. Point the app at it with GEMINI_API_ENDPOINT=<stub.url>.
+
+Both can also be run standalone:
+
+    python benchmarks/stubs.py --llama-port 8080 --gemini-port 8081 --latency 0.2 --tokens-per-second 40
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = json.dumps({
+    "original_phrase": "堀川の大殿様のやうな方は",
+    "translations": [
+        "Uma pessoa como o senhor de Horikawa.",
+        "Alguém como o grande senhor de Horikawa.",
+        "Pessoas como o senhor de Horikawa.",
+        "Homens como o nobre de Horikawa.",
+    ],
+}, ensure_ascii=False)
+
+
+def answer_chunks(answer, chunk_chars=4):
+    return [answer[i:i + chunk_chars] for i in range(0, len(answer), chunk_chars)]
+
+
+class StubServer:
+    """Runs a ThreadingHTTPServer with `handler_class` on a free local port in a background thread."""
+
+    handler_class = None
+
+    def __init__(self, host='127.0.0.1', port=0, **settings):
+        handler = type('Handler', (self.handler_class,), {'stub': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()  # Client (host, port) pairs seen, i.e. TCP connections opened
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, client_address):
+        with self.lock:
+            self.requests += 1
+            self.connections.add(client_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes; avoid delayed-ACK stalls
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def injected_error(self):
+        """Sends an injected 429/500 if the dice say so. Returns True when it did."""
+        settings = self.stub.settings
+        if random.random() < settings.get('rate_limit_rate', 0.0):
+            self.send_json(429, {'error': {'code': 429, 'message': 'Resource exhausted (stub)', 'status': 'RESOURCE_EXHAUSTED'}},
+                           {'Retry-After': '1'})
+            return True
+        if random.random() < settings.get('error_rate', 0.0):
+            self.send_json(500, {'error': {'code': 500, 'message': 'Internal error (stub)', 'status': 'INTERNAL'}})
+            return True
+        return False
+
+
+class LlamaHandler(JSONHandler):
+
+    def do_POST(self):
+        self.stub.count(self.client_address)
+        data = self.read_json()
+        if self.path != '/completion':
+            self.send_json(404, {'error': 'not found'})
+            return
+        settings = self.stub.settings
+        time.sleep(settings.get('latency', 0.0))  # Prompt processing
+        if self.injected_error():
+            return
+
+        answer = settings.get('answer', ANSWER)
+        chunks = answer_chunks(answer) if data.get('n_predict', -1) != 0 else []
+        token_delay = 1.0 / settings['tokens_per_second'] if settings.get('tokens_per_second') else 0.0
+        timings = {
+            'prompt_n': len(data.get('prompt', '')),
+            'prompt_ms': settings.get('latency', 0.0) * 1000,
+            'predicted_n': len(chunks),
+            'predicted_ms': token_delay * len(chunks) * 1000,
+            'predicted_per_second': settings.get('tokens_per_second'),
+        }
+
+        if data.get('stream'):
+            self.start_chunked('text/event-stream')
+            for chunk in chunks:
+                time.sleep(token_delay)
+                self.write_chunk(f"data: {json.dumps({'content': chunk, 'stop': False})}\n\n".encode("utf-8"))
+            final = {'content': '', 'stop': True, 'timings': timings}
+            self.write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            self.end_chunked()
+        else:
+            time.sleep(token_delay * len(chunks))
+            self.send_json(200, {
+                'content': ''.join(chunks),
+                'stop': True,
+                'timings': timings,
+                'tokens_cached': 0,
+                'tokens_evaluated': timings['prompt_n'],
+                'tokens_predicted': len(chunks),
+                'id_slot': data.get('id_slot', 0),
+            })
+
+
+class LlamaStubServer(StubServer):
+    """Fake llama.cpp server. Settings: latency (s), tokens_per_second, error_rate, rate_limit_rate, answer."""
+
+    handler_class = LlamaHandler
+
+
+class GeminiHandler(JSONHandler):
+
+    def do_POST(self):
+        self.stub.count(self.client_address)
+        data = self.read_json()
+        path = self.path.split('?', 1)[0]
+        settings = self.stub.settings
+        prompt = ''.join(part.get('text', '') for content in data.get('contents', []) for part in content.get('parts', []))
+        prompt_tokens = max(len(prompt) // 2, 1)
+
+        if path.endswith(':countTokens'):
+            self.send_json(200, {'totalTokens': prompt_tokens})
+            return
+        if not (path.endswith(':generateContent') or path.endswith(':streamGenerateContent')):
+            self.send_json(404, {'error': {'code': 404, 'message': 'not found', 'status': 'NOT_FOUND'}})
+            return
+
+        time.sleep(settings.get('latency', 0.0))
+        if self.injected_error():
+            return
+
+        answer = '```json\n' + settings.get('answer', ANSWER) + '\n```'
+        chunks = answer_chunks(answer, 16)
+        token_delay = 1.0 / settings['tokens_per_second'] if settings.get('tokens_per_second') else 0.0
+        usage = {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': len(chunks) * 4,
+                 'totalTokenCount': prompt_tokens + len(chunks) * 4}
+
+        def response(text, final):
+            candidate = {'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}
+            if final:
+                candidate['finishReason'] = 'STOP'
+            return {'candidates': [candidate], 'usageMetadata': usage}
+
+        if path.endswith(':streamGenerateContent'):
+            sse = 'alt=sse' in self.path
+            self.start_chunked('text/event-stream' if sse else 'application/json')
+            if not sse:
+                self.write_chunk(b'[')
+            for i, chunk in enumerate(chunks):
+                time.sleep(token_delay * 4)
+                body = json.dumps(response(chunk, i == len(chunks) - 1), ensure_ascii=False)
+                if sse:
+                    self.write_chunk(f"data: {body}\r\n\r\n".encode("utf-8"))
+                else:
+                    self.write_chunk(((',' if i else '') + body).encode("utf-8"))
+            if not sse:
+                self.write_chunk(b']')
+            self.end_chunked()
+        else:
+            time.sleep(token_delay * 4 * len(chunks))
+            self.send_json(200, response(answer, True))
+
+
+class GeminiStubServer(StubServer):
+    """Fake Gemini REST API. Settings: latency (s), tokens_per_second, error_rate, rate_limit_rate, answer."""
+
+    handler_class = GeminiHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run fake llama.cpp and Gemini servers.")
+    parser.add_argument('--llama-port', type=int, default=8080)
+    parser.add_argument('--gemini-port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="Generation speed (0: instant)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args(argv)
+
+    settings = dict(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                    error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    llama = LlamaStubServer(port=args.llama_port, **settings).start()
+    gemini = GeminiStubServer(port=args.gemini_port, **settings).start()
+    print(f"llama.cpp stub at {llama.url}, Gemini stub at {gemini.url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        llama.stop()
+        gemini.stop()
+
+
+if __name__ == '__main__':
+    main()
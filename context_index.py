@@ -0,0 +1,114 @@
+import heapq
+import math
+import threading
+from collections import Counter
+
+
+def char_ngrams(text, n=2):
+    """Character n-grams of `text` with whitespace removed. Short strings yield themselves."""
+    text = ''.join(text.split())
+    if len(text) <= n:
+        return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+class NgramIndex:
+    """Incremental BM25 index over character bigrams, which works for Japanese without a tokenizer."""
+
+    def __init__(self, n=2, k1=1.2, b=0.75, max_candidates=512):
+        self.n = n
+        self.k1 = k1
+        self.b = b
+        self.max_candidates = max_candidates  # Documents scored per search at most, best partial scores kept
+        self.lock = threading.RLock()
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.doc_terms = {}  # doc_id -> Counter of terms
+        self.doc_lengths = {}  # doc_id -> number of n-grams
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, doc_id, text):
+        with self.lock:
+            if doc_id in self.doc_terms:
+                self.remove(doc_id)
+            terms = Counter(char_ngrams(text, self.n))
+            self.doc_terms[doc_id] = terms
+            self.doc_lengths[doc_id] = sum(terms.values())
+            self.total_length += self.doc_lengths[doc_id]
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id):
+        with self.lock:
+            terms = self.doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            self.total_length -= self.doc_lengths.pop(doc_id)
+            for term in terms:
+                docs = self.postings[term]
+                del docs[doc_id]
+                if not docs:
+                    del self.postings[term]
+
+    def clear(self):
+        with self.lock:
+            self.postings = {}
+            self.doc_terms = {}
+            self.doc_lengths = {}
+            self.total_length = 0
+
+    def search(self, query, k=10):
+        """Returns up to `k` (doc_id, score) pairs, best first. Documents sharing no n-gram are never returned.
+
+        Terms are scored rarest first (highest possible contribution first), walking
+        their posting lists. Once the terms left could not lift an unseen document into
+        the top `k` (MaxScore), or `max_candidates` documents have been found, the long
+        posting lists of the common terms are not walked: the documents already found
+        are scored against the remaining terms one by one. The cap makes the result
+        approximate when more than `max_candidates` documents share the query's rarer
+        n-grams; the candidates with the best partial scores are kept.
+        """
+        with self.lock:
+            doc_count = len(self.doc_terms)
+            if doc_count == 0:
+                return []
+            avg_length = self.total_length / doc_count or 1
+            terms = []
+            for term in set(char_ngrams(query, self.n)):
+                docs = self.postings.get(term)
+                if docs:
+                    idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                    terms.append((idf * (self.k1 + 1), term, docs))  # Most one document can get from the term
+            terms.sort(key=lambda term: term[0], reverse=True)
+            remaining = sum(term[0] for term in terms)  # Most the terms not scored yet can add
+
+            doc_lengths = self.doc_lengths
+            length_base = self.k1 * (1 - self.b)  # BM25 length normalization: tf + k1 * (1 - b + b * length / avg)
+            length_factor = self.k1 * self.b / avg_length
+            scores = {}
+            threshold = 0.0  # k-th best score so far
+            for position, (bound, _, docs) in enumerate(terms):
+                if len(scores) >= k and (len(scores) >= self.max_candidates or remaining <= threshold):
+                    # No unseen document can make it any more: finish scoring the ones found
+                    rest = {term: weight for weight, term, _ in terms[position:]}
+                    for doc_id in scores:
+                        norm = length_base + length_factor * doc_lengths[doc_id]
+                        for term, tf in self.doc_terms[doc_id].items():
+                            weight = rest.get(term)
+                            if weight is not None:
+                                scores[doc_id] += weight * tf / (tf + norm)
+                    break
+                remaining -= bound
+                get_score = scores.get
+                for doc_id, tf in docs.items():
+                    scores[doc_id] = get_score(doc_id, 0.0) + bound * tf / (tf + length_base + length_factor * doc_lengths[doc_id])
+                if len(scores) > k:
+                    threshold = heapq.nlargest(k, scores.values())[-1]
+                    cutoff = threshold - remaining - 1e-9  # Slack for rounding, so ties are kept
+                    # Drop documents that cannot reach the top k even with every remaining term
+                    scores = {doc_id: score for doc_id, score in scores.items() if score >= cutoff}
+                    if len(scores) > self.max_candidates:
+                        scores = dict(heapq.nlargest(self.max_candidates, scores.items(), key=lambda item: item[1]))
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
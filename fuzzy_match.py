@@ -0,0 +1,129 @@
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from context_index import char_ngrams
+
+# Ruby annotations: ｜漢字《かんじ》, 漢字《かんじ》 and readings in parentheses after kanji, 漢字（かんじ）
+RUBY_PATTERN = re.compile(r'｜|《[^》]*》|(?<=[㐀-䶿一-鿿々〆])[（(][ぁ-ゖァ-ヺー]+[）)]')
+
+
+def normalize(text):
+    """Matching form of a sentence: ruby readings removed, NFKC (full/half width folded),
+    only letters and digits kept, case folded."""
+    text = unicodedata.normalize('NFKC', RUBY_PATTERN.sub('', text))
+    return ''.join(char for char in text if unicodedata.category(char)[0] in 'LN').casefold()
+
+
+class FuzzyIndex:
+    """Finds the saved sentence most similar to a query, by Dice similarity of character bigrams.
+
+    Sentences are compared in `normalize`d form, so punctuation, width and ruby
+    readings do not matter, and readings flattened into the text (桃もも) only lower
+    the similarity a little. Lookups use prefix filtering: with the bigrams of every
+    sentence sorted in one fixed order, two sentences can only reach `threshold` if
+    the first few bigrams of each share one, so only those are indexed and probed.
+    The order puts the bigrams that were rarest when `build` last ran first, which
+    keeps the posting lists short; bigrams first seen later count as rarest. The
+    result is exact whatever the order.
+    """
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        self.jaccard = threshold / (2 - threshold)  # Same cutoff expressed as Jaccard similarity
+        self.lock = threading.RLock()
+        self.docs = {}  # doc_id -> (normalized text, bigram set)
+        self.postings = {}  # prefix bigram -> set of doc_ids
+        self.exact = {}  # normalized text -> doc_id
+        self.ranks = {}  # bigram -> position in the order set by the last build, rarest first
+
+    def __len__(self):
+        return len(self.docs)
+
+    def prefix(self, tokens):
+        """The tokens of a sorted set that must overlap for the sets to reach the threshold."""
+        return tokens[:len(tokens) - math.ceil(self.jaccard * len(tokens)) + 1]
+
+    def sorted_tokens(self, token_set):
+        ranks = self.ranks
+        try:
+            return sorted(token_set, key=ranks.__getitem__)
+        except KeyError:  # Bigrams unknown to the last build go first, in string order
+            return sorted(token_set, key=lambda token: (ranks.get(token, -1), token))
+
+    def build(self, items):
+        """Replaces the contents with (doc_id, text) pairs and re-derives the bigram order from them."""
+        with self.lock:
+            docs = []
+            frequencies = Counter()
+            for doc_id, text in items:
+                normalized = normalize(text)
+                token_set = frozenset(char_ngrams(normalized))
+                frequencies.update(token_set)
+                docs.append((doc_id, normalized, token_set))
+            self.clear()
+            self.ranks = {token: rank for rank, token in
+                          enumerate(sorted(frequencies, key=lambda token: (frequencies[token], token)))}
+            for doc_id, normalized, token_set in docs:
+                self._add(doc_id, normalized, token_set)
+
+    def add(self, doc_id, text):
+        with self.lock:
+            if doc_id in self.docs:
+                self.remove(doc_id)
+            normalized = normalize(text)
+            self._add(doc_id, normalized, frozenset(char_ngrams(normalized)))
+
+    def _add(self, doc_id, normalized, token_set):
+        if not token_set:
+            return
+        self.docs[doc_id] = (normalized, token_set)
+        self.exact[normalized] = doc_id
+        for token in self.prefix(self.sorted_tokens(token_set)):
+            self.postings.setdefault(token, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        with self.lock:
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                return
+            if self.exact.get(doc[0]) == doc_id:
+                del self.exact[doc[0]]
+            for token in self.prefix(self.sorted_tokens(doc[1])):
+                docs = self.postings[token]
+                docs.discard(doc_id)
+                if not docs:
+                    del self.postings[token]
+
+    def clear(self):
+        with self.lock:
+            self.docs = {}
+            self.postings = {}
+            self.exact = {}
+            self.ranks = {}
+
+    def best_match(self, query):
+        """Returns (doc_id, similarity) of the most similar sentence at or above the threshold, or None."""
+        normalized = normalize(query)
+        query_set = frozenset(char_ngrams(normalized))
+        if not query_set:
+            return None
+        size = len(query_set)
+        best = None
+        with self.lock:
+            if normalized in self.exact:
+                return self.exact[normalized], 1.0
+            candidates = set()
+            for token in self.prefix(self.sorted_tokens(query_set)):
+                candidates.update(self.postings.get(token, ()))
+            for doc_id in candidates:
+                doc_normalized, doc_set = self.docs[doc_id]
+                doc_size = len(doc_set)
+                if doc_size < self.jaccard * size or size < self.jaccard * doc_size:
+                    continue  # Too different in length to reach the threshold
+                similarity = 2 * len(query_set & doc_set) / (size + doc_size)
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (doc_id, similarity)
+        return best
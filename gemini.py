@@ -1,25 +1,110 @@
 
 
-import google.generativeai as genai  # pip install google-generativeai
 from google.api_core import exceptions as google_exceptions # Import for specific exception handling
+import os
+import requests
+import threading
 import time
+from contextlib import contextmanager
 from dotenv import dotenv_values
+from tokens import estimate_tokens
+from metrics import REGISTRY, STAGE_SECONDS
+from rate_limit import BudgetExhausted, RateScheduler
+
+genai = None  # google.generativeai (pip install google-generativeai), imported and configured on first use
+
+GEMINI_STEP_SECONDS = REGISTRY.histogram('gemini_step_seconds', 'Seconds per step of a Gemini completion.', ['step'])
+# 429s: the gRPC transport raises ResourceExhausted, the REST one (GEMINI_API_ENDPOINT) TooManyRequests
+RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+GEMINI_TOKENS = REGISTRY.counter('gemini_tokens_total', 'Tokens reported in Gemini usage metadata.', ['model', 'kind'])
 
 class LLM:
     
-    config = dotenv_values(".env")  # config = {"USER": "foo", "EMAIL": "foo@example.org"}
-    api_key = config["GOOGLE_API_KEY"]
+    api_key = None  # Read from .env by `configure`
     MODEL_NAME = "gemini-2.5-flash-preview-05-20"
     MODEL_FALLBACK_NAME = "gemini-2.0-flash-001" # A model that might have different limits or capabilities
     HYPOTHETICAL_MODEL_LIMIT_PRIMARY = 245000  # Primary model's hypothetical token limit for the whole prompt
     HYPOTHETICAL_MODEL_LIMIT_FALLBACK = 1000000 # Fallback model's hypothetical token limit
-    RETRY_DELAY_SECONDS = 3
+    context_tokens = HYPOTHETICAL_MODEL_LIMIT_PRIMARY  # Packed prompts are sized to stay on the primary model
+    RETRY_DELAY_SECONDS = 3  # How long a model is held back after an unexpected 429
     MAX_TEXT_FALLBACK_RETRIES = 1
-    
-    genai.configure(api_key=api_key)
+    # Client-side budgets (requests, tokens per minute); requests beyond them are queued or sent to the fallback
+    PRIMARY_RATE_LIMITS = (10, 250000)
+    FALLBACK_RATE_LIMITS = (15, 1000000)
+    RATE_QUEUE_TIMEOUT = 60  # Seconds a request may wait for rate budget
+    TOKEN_ESTIMATE_MARGIN = 0.8  # Trust the local token estimate below this fraction of a limit, count remotely above it
+
+    configure_lock = threading.Lock()
+    models = {}  # model name -> genai.GenerativeModel, shared for the life of the process
+
+    def __init__(self, primary_rate_limits=None, fallback_rate_limits=None):
+        self.step_timings = threading.local()
+        self.scheduler = RateScheduler({
+            self.MODEL_NAME: primary_rate_limits or self.PRIMARY_RATE_LIMITS,
+            self.MODEL_FALLBACK_NAME: fallback_rate_limits or self.FALLBACK_RATE_LIMITS,
+        })
+
+    @classmethod
+    def configure(cls):
+        """Imports google.generativeai and configures it with the key from .env, once per process."""
+        global genai
+        if genai is not None:
+            return genai
+        with cls.configure_lock:
+            if genai is None:
+                config = dotenv_values(".env")  # config = {"USER": "foo", "EMAIL": "foo@example.org"}
+                cls.api_key = config.get("GOOGLE_API_KEY") or os.environ["GOOGLE_API_KEY"]
+                import google.generativeai as genai_module
+                endpoint = config.get("GEMINI_API_ENDPOINT") or os.environ.get("GEMINI_API_ENDPOINT")
+                if endpoint:
+                    # Alternative endpoint, e.g. the local stub in benchmarks/stubs.py
+                    genai_module.configure(api_key=cls.api_key, transport="rest", client_options={"api_endpoint": endpoint})
+                else:
+                    genai_module.configure(api_key=cls.api_key)
+                genai = genai_module
+        return genai
+
+    @classmethod
+    def get_model(cls, model_name):
+        """Returns the cached GenerativeModel for `model_name`, creating it on first use."""
+        model = cls.models.get(model_name)
+        if model is None:
+            model = cls.models.setdefault(model_name, cls.configure().GenerativeModel(model_name))
+        return model
+
+    @contextmanager
+    def timed(self, step):
+        """Records how long the block took under `step` in `last_timings()`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            timings = self.last_timings()
+            timings[step] = timings.get(step, 0.0) + elapsed * 1000
+            GEMINI_STEP_SECONDS.observe(elapsed, step=step)
+            if step in ('token_estimate', 'count_tokens'):
+                STAGE_SECONDS.observe(elapsed, stage='token_count')
+
+    @staticmethod
+    def record_usage(model_name, response):
+        """Counts the prompt and output tokens Gemini reports for a (finished) response."""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        GEMINI_TOKENS.inc(getattr(usage, 'prompt_token_count', 0) or 0, model=model_name, kind='prompt')
+        GEMINI_TOKENS.inc(getattr(usage, 'candidates_token_count', 0) or 0, model=model_name, kind='output')
+
+    def last_timings(self):
+        """Per-step latencies in ms of the latest completion on the current thread."""
+        if not hasattr(self.step_timings, 'steps'):
+            self.step_timings.steps = {}
+        return self.step_timings.steps
 
     def list_models(self):
         from google import genai as genai_models
+
+        self.configure()
         
         models = list()
 
@@ -36,19 +121,33 @@ class LLM:
             print(f"{model.input_token_limit} {model.display_name} {model.name}")
 
     
+    def cache_params(self, **kwargs):
+        """Model settings that, together with the prompt, determine the answer (used for response caching)."""
+        return dict(kwargs, model=self.MODEL_NAME, fallback_model=self.MODEL_FALLBACK_NAME)
+
     def get_token_count(self, model_instance, content_parts):
         """Counts tokens for the given content parts using the specified model instance."""
         try:
             # Ensure content_parts is suitable for count_tokens
             # count_tokens expects `contents` which can be str | File | Iterable[str | File | Part]`
             # If content_parts is already a list like [question, file_or_text_content], it's fine.
-            return model_instance.count_tokens(content_parts).total_tokens
+            with self.timed('count_tokens'):
+                return model_instance.count_tokens(content_parts).total_tokens
         except Exception as e:
             print(f"  Warning: Could not count tokens for model {model_instance.model_name}. Error: {e}")
             return float('inf') # Assume worst case if count fails
 
     def select_model_based_on_tokens(self, primary_model, fallback_model, prompt_parts, primary_limit, fallback_limit):
-        """Selects a model based on token count and defined limits."""
+        """Selects a model based on token count and defined limits.
+
+        A local estimate decides when the prompt is clearly below the primary limit;
+        the remote `count_tokens` call is only made when it is close to the limit.
+        """
+        with self.timed('token_estimate'):
+            estimate = sum(estimate_tokens(part) for part in prompt_parts if isinstance(part, str))
+        if estimate <= primary_limit * self.TOKEN_ESTIMATE_MARGIN:
+            return primary_model, estimate
+
         token_count_primary = self.get_token_count(primary_model, prompt_parts)
         if token_count_primary <= primary_limit:
             print(f"  Prompt fits primary model {primary_model.model_name} ({token_count_primary} tokens, limit: {primary_limit}).")
@@ -63,90 +162,166 @@ class LLM:
                 print(f"  Prompt too large for both primary ({token_count_primary} tokens, limit: {primary_limit}) and fallback ({token_count_fallback} tokens, limit: {fallback_limit}) models.")
                 return None, token_count_primary # Return None and primary's count for logging
 
-    def ask_gemini_with_text_retry(self, chosen_model, question, text_content, pdf_name_for_logging):
-        """Asks Gemini with extracted text, includes retry logic for 429 errors, using the chosen model."""
+    @staticmethod
+    def time_left(deadline):
+        """Seconds until `deadline` (a time.monotonic() value), or None without one."""
+        return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+    def request_options(self, deadline):
+        """generate_content arguments that stop the HTTP call at `deadline`."""
+        if deadline is None:
+            return {}
+        return {'request_options': {'timeout': max(self.time_left(deadline), 0.001)}}
+
+    def schedule(self, candidates, token_count, timeout=None):
+        """Reserves rate budget for one request and returns the model to send it to.
+
+        `candidates` are the models able to take the prompt, preferred first. The first
+        one with budget free right now is used, so overflow goes to the fallback before
+        the API has to refuse it; when none has, the request waits in line for the one
+        that frees up first, for at most RATE_QUEUE_TIMEOUT or `timeout` seconds.
+        """
+        for model in candidates:
+            if self.scheduler.try_acquire(self.rate_key(model), token_count):
+                if model is not candidates[0]:
+                    print(f"  {candidates[0].model_name} is at its rate limit; using {model.model_name}.")
+                return model
+        model = min(candidates, key=lambda m: self.scheduler.wait_time(self.rate_key(m), token_count))
+        print(f"  Waiting for rate budget of {model.model_name}...")
+        with self.timed('rate_wait'):
+            self.scheduler.acquire(self.rate_key(model), token_count,
+                                   self.RATE_QUEUE_TIMEOUT if timeout is None else min(timeout, self.RATE_QUEUE_TIMEOUT))
+        return model
+
+    def candidates_for(self, chosen_model):
+        """Models that can take a prompt `select_model_based_on_tokens` assigned to `chosen_model`, preferred first."""
+        fallback_model = self.get_model(self.MODEL_FALLBACK_NAME)
+        return [chosen_model] if chosen_model is fallback_model else [chosen_model, fallback_model]
+
+    @staticmethod
+    def rate_key(model):
+        """Scheduler key of a GenerativeModel (its name without the `models/` prefix)."""
+        return model.model_name.split('/')[-1]
+
+    def settle_usage(self, model, reserved_tokens, response):
+        """Records the usage of a finished response and corrects the token reservation with it."""
+        self.record_usage(model.model_name, response)
+        usage = getattr(response, 'usage_metadata', None)
+        used = getattr(usage, 'total_token_count', 0) if usage is not None else 0
+        if used:
+            self.scheduler.settle(self.rate_key(model), reserved_tokens, used)
+
+    def ask_gemini_with_text_retry(self, chosen_model, question, text_content=None, pdf_name_for_logging=None, token_count=None,
+                                   timeout=None):
+        """Asks Gemini with extracted text through the rate scheduler, starting with `chosen_model`.
+
+        A 429 despite the client-side budget holds that model back for RETRY_DELAY_SECONDS
+        and the request is rescheduled, on the fallback model if it has budget. `timeout`
+        bounds the whole call in seconds, rate wait included.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        prompt_parts_text = [question] if text_content is None else [question, text_content]
+        if token_count is None:
+            token_count = sum(estimate_tokens(part) for part in prompt_parts_text if isinstance(part, str))
+        candidates = self.candidates_for(chosen_model)
+        model = self.schedule(candidates, token_count, self.time_left(deadline))
         for attempt in range(self.MAX_TEXT_FALLBACK_RETRIES + 1):
             try:
-                prompt_parts_text = [question, text_content]
-                print(f"  Asking Gemini with extracted text using model {chosen_model.model_name} (attempt {attempt + 1})...")
-                response = chosen_model.generate_content(prompt_parts_text)
+                print(f"  Asking Gemini with extracted text using model {model.model_name} (attempt {attempt + 1})...")
+                with self.timed('generate_content'):
+                    response = model.generate_content(prompt_parts_text, **self.request_options(deadline))
+                self.settle_usage(model, token_count, response)
                 return response.text
-            except google_exceptions.ResourceExhausted as e_rate:
-                print(f"  Rate limit hit (429) for {chosen_model.model_name}: {e_rate}.")
-                if attempt < self.MAX_TEXT_FALLBACK_RETRIES:
-                    print(f"  Waiting {self.RETRY_DELAY_SECONDS}s and retrying (attempt {attempt + 2}/{self.MAX_TEXT_FALLBACK_RETRIES + 1})...")
-                    time.sleep(self.RETRY_DELAY_SECONDS)
-                else:
-                    print(f"  Max retries reached after rate limit with {chosen_model.model_name}.")
+            except RATE_LIMIT_ERRORS as e_rate:
+                print(f"  Rate limit hit (429) for {model.model_name}: {e_rate}.")
+                self.scheduler.exhausted(self.rate_key(model), self.RETRY_DELAY_SECONDS)
+                if attempt >= self.MAX_TEXT_FALLBACK_RETRIES:
+                    print(f"  Max retries reached after rate limit with {model.model_name}.")
                     raise
+                model = self.schedule(candidates, token_count, self.time_left(deadline))
             except Exception as e_text_processing:
-                print(f"  Error asking Gemini using {chosen_model.model_name}: {e_text_processing}")
+                print(f"  Error asking Gemini using {model.model_name}: {e_text_processing}")
                 raise
         return None # Should only be reached if MAX_TEXT_FALLBACK_RETRIES is < 0 (which it isn't)
 
-    def completion(self, prompt):
-        
+    def completion(self, prompt, timeout=None):
+        """Answers `prompt`, or returns an "Error: ..." text. Rate limits and timeouts (after `timeout` seconds) raise."""
         question = prompt
+        self.step_timings.steps = {}
+        deadline = None if timeout is None else time.monotonic() + timeout  # Model setup and token counting count too
+        answer_text = "Error: Prompt too large for both primary and fallback models."
 
-        primary_model_instance = genai.GenerativeModel(self.MODEL_NAME)
-        fallback_model_instance = genai.GenerativeModel(self.MODEL_FALLBACK_NAME)
-
-        # print(f"Using primary model: {self.MODEL_NAME}")
-        # print(f"Using fallback model: {self.MODEL_FALLBACK_NAME}")
-        # print(f"Primary model hypothetical token limit: {self.HYPOTHETICAL_MODEL_LIMIT_PRIMARY}")
-        # print(f"Fallback model hypothetical token limit: {self.HYPOTHETICAL_MODEL_LIMIT_FALLBACK}")
+        with self.timed('model_lookup'):
+            primary_model_instance = self.get_model(self.MODEL_NAME)
+            fallback_model_instance = self.get_model(self.MODEL_FALLBACK_NAME)
 
         try:
+            chosen_model, token_count = self.select_model_based_on_tokens(
+                primary_model_instance, fallback_model_instance, [question],
+                self.HYPOTHETICAL_MODEL_LIMIT_PRIMARY, self.HYPOTHETICAL_MODEL_LIMIT_FALLBACK
+            )
+            if chosen_model:
+                answer_text = self.ask_gemini_with_text_retry(chosen_model, question, token_count=token_count,
+                                                              timeout=self.time_left(deadline))
 
-                prompt_parts_file = [question]
-                chosen_model_for_file_api, _ = self.select_model_based_on_tokens(
-                    primary_model_instance, fallback_model_instance, prompt_parts_file,
-                    self.HYPOTHETICAL_MODEL_LIMIT_PRIMARY, self.HYPOTHETICAL_MODEL_LIMIT_FALLBACK
-                )
-
-                if chosen_model_for_file_api:
-                    print(f"  Asking Gemini using model: {chosen_model_for_file_api.model_name}...")
-                    final_model_used_name = chosen_model_for_file_api.model_name
-                    response = chosen_model_for_file_api.generate_content(prompt_parts_file)
-                    answer_text = response.text
-
-        except google_exceptions.ResourceExhausted as e_rate_limit:
-            print(f"  Rate limit hit (429) during processing: {e_rate_limit}.")
-            prompt_parts_text = [question]
-            # Check if fallback model can handle the text content
-            token_count_fallback_text = self.get_token_count(fallback_model_instance, prompt_parts_text)
-            if token_count_fallback_text <= self.HYPOTHETICAL_MODEL_LIMIT_FALLBACK:
-                try:
-                    final_model_used_name = fallback_model_instance.model_name
-                    answer_text = self.ask_gemini_with_text_retry(fallback_model_instance, question)
-                except Exception as e_text_fallback_after_rate_limit:
-                    answer_text = f"Error: Text fallback also failed after initial rate limit. Details: {e_text_fallback_after_rate_limit}"
-            else:
-                answer_text = f"Error: Text content ({token_count_fallback_text} tokens) too large for fallback model after rate limit."
+        except (BudgetExhausted, google_exceptions.DeadlineExceeded, requests.exceptions.Timeout):
+            raise  # Answered with 429 / 503 by the app
 
+        except RATE_LIMIT_ERRORS as e_rate_limit:
+            raise BudgetExhausted(f"Rate limit hit on every Gemini model: {e_rate_limit}",
+                                  self.RETRY_DELAY_SECONDS) from e_rate_limit
 
         except google_exceptions.InvalidArgument as e_invalid_arg:
-            print(f"  InvalidArgument error processing (possibly with File API): {e_invalid_arg}.")
-            print(f"  Attempting text extraction fallback...")
-            prompt_parts_text = [question]
-            chosen_model, _ = self.select_model_based_on_tokens(
-                primary_model_instance, fallback_model_instance, prompt_parts_text,
-                self.HYPOTHETICAL_MODEL_LIMIT_PRIMARY, self.HYPOTHETICAL_MODEL_LIMIT_FALLBACK
-            )
-            if chosen_model:
-                final_model_used_name = chosen_model.model_name
-                try:
-                    answer_text = self.ask_gemini_with_text_retry(chosen_model, question)
-                except Exception as e_text_fallback_after_invalid_arg:
-                    answer_text = f"Error: Text fallback failed after InvalidArgument. Details: {e_text_fallback_after_invalid_arg}"
-            else:
-                answer_text = f"Error: Text content (after InvalidArgument) too large."
-           
+            print(f"  InvalidArgument error processing prompt: {e_invalid_arg}.")
+            answer_text = f"Error: Invalid request. Details: {e_invalid_arg}"
+
         except Exception as e_general:
             print(f"  A general error occurred while processing prompt: {e_general}")
             answer_text = f"Error: A general error occurred. Details: {e_general}"
 
-        finally:
-            return answer_text
+        return answer_text
+
+    def completion_stream(self, prompt, timeout=None):
+        """Like `completion`, but yields the answer text chunk by chunk as Gemini streams it."""
+        self.step_timings.steps = {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.timed('model_lookup'):
+            primary_model_instance = self.get_model(self.MODEL_NAME)
+            fallback_model_instance = self.get_model(self.MODEL_FALLBACK_NAME)
+        prompt_parts = [prompt]
 
+        chosen_model, token_count = self.select_model_based_on_tokens(
+            primary_model_instance, fallback_model_instance, prompt_parts,
+            self.HYPOTHETICAL_MODEL_LIMIT_PRIMARY, self.HYPOTHETICAL_MODEL_LIMIT_FALLBACK
+        )
+        if chosen_model is None:
+            raise ValueError(f"Prompt ({token_count} tokens) too large for both models.")
 
+        candidates = self.candidates_for(chosen_model)
+        model = self.schedule(candidates, token_count, self.time_left(deadline))
+        for attempt in range(self.MAX_TEXT_FALLBACK_RETRIES + 1):
+            print(f"  Streaming from Gemini using model: {model.model_name}...")
+            try:
+                with self.timed('first_chunk'):
+                    chunks = iter(model.generate_content(prompt_parts, stream=True, **self.request_options(deadline)))
+                    first_chunk = next(chunks, None)
+                break
+            except RATE_LIMIT_ERRORS as e_rate_limit:
+                print(f"  Rate limit hit (429) for {model.model_name}: {e_rate_limit}.")
+                self.scheduler.exhausted(self.rate_key(model), self.RETRY_DELAY_SECONDS)
+                if attempt >= self.MAX_TEXT_FALLBACK_RETRIES:
+                    raise BudgetExhausted(f"Rate limit hit on every Gemini model: {e_rate_limit}",
+                                          self.RETRY_DELAY_SECONDS) from e_rate_limit
+                model = self.schedule(candidates, token_count, self.time_left(deadline))
+
+        if first_chunk is None:
+            return
+        last_chunk = first_chunk
+        try:
+            yield first_chunk.text
+            for chunk in chunks:
+                last_chunk = chunk
+                yield chunk.text
+        finally:
+            # The final chunk carries the usage metadata; a stream closed early settles with the latest report
+            self.settle_usage(model, token_count, last_chunk)
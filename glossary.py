@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import deque
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: finds every pattern occurring in a text in a single pass over the text."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]  # state -> {char: next state}
+        self.fail = [0]
+        self.output = [[]]  # state -> indexes of patterns ending at this state
+        for pattern_index, pattern in enumerate(patterns):
+            if pattern:
+                self._add(pattern, pattern_index)
+        self._build()
+
+    def _add(self, pattern, pattern_index):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(pattern_index)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, text):
+        """Returns the set of indexes of the patterns found in `text`."""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found.update(self.output[state])
+        return found
+
+
+class Glossary:
+    """`glossary.txt` parsed into an Aho-Corasick automaton keyed on the source term of each line.
+
+    Lines look like `堀川 - Horikawa (...)`; the part before ` - ` is the term. Lines
+    without a term are kept in every result. The automaton is rebuilt when the
+    file's mtime or size change.
+    """
+
+    SEPARATOR = ' - '
+
+    def __init__(self, path='glossary.txt'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file_stamp = None
+        self.parsed = ([], [], AhoCorasick([]))  # (always_lines, lines, matcher), swapped as one
+
+    def _stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        with open(self.path, 'r', encoding="utf-8") as f:
+            content = f.read()
+        self.parse(content)
+
+    def parse(self, content):
+        lines, terms, always_lines = [], [], []
+        for line in content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if self.SEPARATOR in line:
+                lines.append(line)
+                terms.append(line.split(self.SEPARATOR, 1)[0].strip())
+            else:
+                always_lines.append(line)
+        self.parsed = (always_lines, lines, AhoCorasick(terms))
+
+    def refresh(self):
+        with self.lock:
+            stamp = self._stamp()
+            if stamp != self.file_stamp:
+                self.load()
+                self.file_stamp = stamp
+
+    def matching_lines(self, sentence):
+        """Returns the glossary lines whose terms occur in `sentence`, in file order."""
+        self.refresh()
+        always_lines, lines, matcher = self.parsed
+        return always_lines + [lines[i] for i in sorted(matcher.find(sentence))]
+
+    def for_prompt(self, sentence):
+        """Glossary text to put in the prompt for `sentence` (empty when nothing matches)."""
+        lines = self.matching_lines(sentence)
+        return '\n'.join(lines) + '\n' if lines else ''
@@ -0,0 +1,164 @@
+"""Minimal Prometheus-style metrics: counters, histograms and callback gauges.
+
+Metrics are registered once at import time in the process-wide REGISTRY and
+rendered in the Prometheus text exposition format by `/metrics`.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}  # label values tuple -> count
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.lock = threading.Lock()
+        self.values = {}  # label values tuple -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall-clock seconds spent in the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(state) for key, state in self.values.items()}
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state):
+                labels = format_labels(self.label_names, key, [('le', format_value(bound))])
+                yield f"{self.name}_bucket{labels} {count}"
+            yield f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(state[-2])}"
+            yield f"{self.name}_count{format_labels(self.label_names, key)} {state[-1]}"
+
+
+class CallbackGauge:
+    """Gauge whose samples come from `callback()`: a number, or a dict of label values tuple -> number."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, callback, label_names=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label_names = tuple(label_names)
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Could not collect metric {self.name}: {e}")
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+
+
+class CallbackCounter(CallbackGauge):
+    """Like CallbackGauge, for counts that only go up and are kept by the object they describe."""
+
+    kind = 'counter'
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, label_names=()):
+        return self.register(Counter(name, help, label_names))
+
+    def histogram(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def gauge(self, name, help, callback, label_names=()):
+        return self.register(CallbackGauge(name, help, callback, label_names))
+
+    def counter_callback(self, name, help, callback, label_names=()):
+        return self.register(CallbackCounter(name, help, callback, label_names))
+
+    def render(self):
+        """Text exposition format, one HELP/TYPE block per metric."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Shared by app.py, admission.py and the backends
+STAGE_SECONDS = REGISTRY.histogram(
+    'translate_stage_seconds',
+    'Seconds spent per translation stage (context_load, prompt_build, token_count, queue_wait, llm_generation, json_extraction).',
+    ['stage'])
@@ -0,0 +1,76 @@
+"""Packed translation: several sentences share one prompt and one LLM call.
+
+The instructions, example JSON, glossary and few-shot context of a prompt are
+often many times longer than the sentence itself. A packed prompt lists N
+sentences and asks for a JSON array with one `{original_phrase, translations}`
+object per sentence; `answer_parser.parse_packed` demultiplexes the answer.
+Sentences missing from a malformed answer are packed again and retried, the
+others are kept.
+"""
+from tokens import estimate_tokens
+
+ANSWER_TOKENS_PER_SENTENCE_TOKEN = 5  # The phrase echoed back plus four translations of it
+ANSWER_TOKENS_OVERHEAD = 40  # JSON keys and punctuation of one entry
+
+
+def estimate_answer_tokens(sentence):
+    """Rough size of one sentence's entry in a packed answer."""
+    return ANSWER_TOKENS_PER_SENTENCE_TOKEN * estimate_tokens(sentence) + ANSWER_TOKENS_OVERHEAD
+
+
+def plan_packs(sentences, fixed_tokens, token_limit, max_sentences=16, sentence_tokens=None):
+    """Splits `sentences` into packs whose prompt and answer fit in `token_limit` tokens.
+
+    `fixed_tokens` is the size of the part of the prompt every pack repeats.
+    `sentence_tokens(sentence)` is what one more sentence adds to prompt and answer
+    (by default the sentence plus its estimated answer). A sentence too long to share
+    a pack still gets a pack of its own.
+    """
+    if sentence_tokens is None:
+        sentence_tokens = lambda sentence: estimate_tokens(sentence) + estimate_answer_tokens(sentence)
+    packs = []
+    current = []
+    used = fixed_tokens
+    for sentence in sentences:
+        cost = sentence_tokens(sentence)
+        if current and (used + cost > token_limit or len(current) >= max_sentences):
+            packs.append(current)
+            current = []
+            used = fixed_tokens
+        current.append(sentence)
+        used += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def translate_packed(sentences, ask_pack, plan, max_attempts=2):
+    """Translates `sentences` pack by pack, retrying only the sentences an answer left out.
+
+    `plan(sentences)` returns the packs to send and `ask_pack(pack)` returns a dict of
+    sentence -> alternatives for the sentences it could parse (it may raise). Returns
+    (results, errors): alternatives per translated sentence and the last error per
+    sentence that never got any.
+    """
+    results = {}
+    errors = {}
+    pending = list(dict.fromkeys(sentences))  # Duplicates are translated once
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        for pack in plan(pending):
+            try:
+                answered = ask_pack(pack)
+            except Exception as e:
+                errors.update((sentence, str(e)) for sentence in pack)
+                continue
+            for sentence in pack:
+                if sentence in answered:
+                    results[sentence] = answered[sentence]
+                    errors.pop(sentence, None)
+                else:
+                    errors[sentence] = 'Missing from the packed answer'
+        pending = [sentence for sentence in pending if sentence not in results]
+        if pending and attempt + 1 < max_attempts:
+            print(f"Retrying {len(pending)} sentence(s) missing from packed answers")
+    return results, errors
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class Prefetcher:
+    """Translates the next sentences of each session's document in the background.
+
+    A session loads a sentence list; every time it asks for a sentence, the next
+    `lookahead` sentences are queued. A single worker thread translates them one at
+    a time, and only while `is_idle(model)` says no foreground request is running or
+    waiting for that backend, so prefetching never competes with the user.
+
+    Results are kept with the prompt they were made from. A result is only handed
+    out if the current prompt for the sentence is identical, so saving a translation
+    that changes the sentence's few-shot examples or glossary lines makes it stale;
+    `invalidate` re-checks the stored results right away and queues stale ones again.
+    """
+
+    def __init__(self, build_prompt, translate, is_idle, lookahead=3, max_sessions=64, poll_seconds=0.2):
+        self.build_prompt = build_prompt  # sentence -> prompt
+        self.translate = translate  # (prompt, model) -> alternatives
+        self.is_idle = is_idle  # model -> True when no foreground request needs the backend
+        self.lookahead = lookahead
+        self.max_sessions = max_sessions
+        self.poll_seconds = poll_seconds
+        self.condition = threading.Condition()
+        self.sessions = OrderedDict()  # session id -> {'sentences', 'model', 'position'}, least recently used first
+        self.results = {}  # (session id, sentence) -> (model, prompt, alternatives)
+        self.queue = deque()  # (session id, sentence) to translate
+        self.running = None  # (session id, sentence) being translated by the worker
+        self.counters = {'prefetched': 0, 'hits': 0, 'misses': 0, 'stale': 0, 'failed': 0}
+        self.thread = None
+
+    def load(self, session_id, sentences, model, position=0):
+        """Sets the session's sentence list and queues the sentences from `position` on."""
+        with self.condition:
+            self.drop_session(session_id)
+            self.sessions[session_id] = {'sentences': list(sentences), 'model': model, 'position': position}
+            while len(self.sessions) > self.max_sessions:
+                self.drop_session(next(iter(self.sessions)))
+            self.schedule(session_id)
+
+    def advance(self, session_id, sentence):
+        """Notes that the session reached `sentence` and queues the ones after it."""
+        with self.condition:
+            state = self.sessions.get(session_id)
+            if state is None:
+                return
+            self.sessions.move_to_end(session_id)
+            sentences = state['sentences']
+            if sentence in sentences[state['position']:]:
+                state['position'] = sentences.index(sentence, state['position']) + 1
+            elif sentence in sentences:
+                state['position'] = sentences.index(sentence) + 1
+            else:
+                return
+            self.schedule(session_id)
+
+    def take(self, session_id, sentence, model, prompt, timeout=None):
+        """Returns the prefetched alternatives for `sentence` if they were made from `prompt`, else None.
+
+        If the worker is translating this very sentence, waits for it (up to `timeout`)
+        instead of starting a second generation.
+        """
+        key = (session_id, sentence)
+        with self.condition:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.running == key:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            result = self.results.pop(key, None)
+            if result is None:
+                self.counters['misses'] += 1
+                return None
+            if result[0] != model or result[1] != prompt:
+                self.counters['stale'] += 1
+                return None
+            self.counters['hits'] += 1
+            return result[2]
+
+    def invalidate(self):
+        """Queues every stored result for a prompt check, e.g. after the translation memory changed."""
+        with self.condition:
+            for key in self.results:
+                if key not in self.queue:
+                    self.queue.appendleft(key)
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counters, sessions=len(self.sessions), stored=len(self.results), queued=len(self.queue))
+
+    def drop_session(self, session_id):
+        if self.sessions.pop(session_id, None) is None:
+            return
+        for key in [key for key in self.results if key[0] == session_id]:
+            del self.results[key]
+        self.queue = deque(key for key in self.queue if key[0] != session_id)
+
+    def schedule(self, session_id):
+        """Queues the next `lookahead` sentences of the session. Called with the condition held."""
+        state = self.sessions[session_id]
+        start = state['position']
+        for sentence in state['sentences'][start:start + self.lookahead]:
+            key = (session_id, sentence)
+            if key not in self.results and key not in self.queue and key != self.running:
+                self.queue.append(key)
+        if self.queue:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='prefetch', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                session_id, sentence = key = self.queue.popleft()
+                state = self.sessions.get(session_id)
+                if state is None:
+                    continue
+                model = state['model']
+
+            while not self.is_idle(model):
+                time.sleep(self.poll_seconds)  # Foreground requests first
+            with self.condition:
+                if session_id not in self.sessions:
+                    continue
+                self.running = key
+                stored = self.results.get(key)
+
+            alternatives = None
+            failed = False
+            try:
+                prompt = self.build_prompt(sentence)
+                if stored is None or stored[0] != model or stored[1] != prompt:  # Else still valid after an invalidate
+                    alternatives = self.translate(prompt, model)
+            except Exception as e:
+                print(f"Prefetch of {sentence!r} failed: {e}")
+                failed = True
+
+            with self.condition:
+                if alternatives is not None and session_id in self.sessions:
+                    self.results[key] = (model, prompt, alternatives)
+                    self.counters['prefetched'] += 1
+                elif failed:
+                    self.results.pop(key, None)
+                    self.counters['failed'] += 1
+                self.running = None
+                self.condition.notify_all()
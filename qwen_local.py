@@ -1,5 +1,56 @@
 import requests
 import json
+import threading
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY
+
+JSON_STRING_GRAMMAR = r'''
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" hex hex hex hex ) )* "\""
+hex ::= [0-9a-fA-F]
+ws ::= ([ \t\n] ws)?
+think ::= "<think>" ( [^<] | "<" [^/] )* "</think>" ws
+'''
+
+
+def translations_object_rule(count=4):
+    """GBNF expression for one `{"original_phrase": "...", "translations": [count strings]}` object."""
+    strings = ' ws "," ws '.join(['string'] * count)
+    return (f'"{{" ws "\\"original_phrase\\":" ws string "," ws '
+            f'"\\"translations\\":" ws "[" ws {strings} ws "]" ws "}}"')
+
+
+def translations_grammar(count=4):
+    """GBNF for `{"original_phrase": "...", "translations": [count strings]}`, optionally after a think block."""
+    return f'root ::= think? {translations_object_rule(count)}\n' + JSON_STRING_GRAMMAR
+
+
+def packed_translations_grammar(sentences, count=4):
+    """GBNF for a JSON array of exactly `sentences` translation objects, as asked by packed prompts."""
+    items = ' ws "," ws '.join(['item'] * sentences)
+    return (f'root ::= think? "[" ws {items} ws "]" ws\n'
+            f'item ::= {translations_object_rule(count)}\n' + JSON_STRING_GRAMMAR)
+
+
+TRANSLATIONS_GRAMMAR = translations_grammar(4)
+
+# `{"translation": "..."}`: one alternative per request, for parallel generation
+SINGLE_TRANSLATION_GRAMMAR = 'root ::= think? "{" ws "\\"translation\\":" ws string ws "}" ws\n' + JSON_STRING_GRAMMAR
+
+# Sampling of the four concurrent requests that each produce one alternative
+ALTERNATIVE_VARIANTS = [
+    {'seed': 1},
+    {'seed': 2, 'preset': 'kindacognizant'},
+    {'seed': 3, 'preset': 'Divine Intellect'},
+    {'seed': 4, 'preset': 'kindacognizant'},
+]
+
+LLAMA_PROMPT_SECONDS = REGISTRY.histogram('llama_prompt_seconds', 'Prompt evaluation time reported by llama.cpp.')
+LLAMA_PREDICTED_PER_SECOND = REGISTRY.histogram('llama_predicted_tokens_per_second', 'Generation speed reported by llama.cpp.',
+                                                buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400))
+LLAMA_PROMPT_TOKENS = REGISTRY.counter('llama_prompt_tokens_total', 'Prompt tokens sent to llama.cpp.')
+LLAMA_PROMPT_TOKENS_REUSED = REGISTRY.counter('llama_prompt_tokens_reused_total', 'Prompt tokens llama.cpp reused from its KV cache.')
+LLAMA_PREDICTED_TOKENS = REGISTRY.counter('llama_predicted_tokens_total', 'Tokens generated by llama.cpp.')
 
 
 class LLM:
@@ -56,6 +107,10 @@ class LLM:
                  # Modify the likelihood of a token appearing in the generated text completion. For example, use `"logit_bias": [[15043,1.0]]` to increase the likelihood of the token 'Hello', or `"logit_bias": [[15043,-1.0]]` to decrease its likelihood. Setting the value to false, `"logit_bias": [[15043,false]]` ensures that the token `Hello` is never produced (default: []).
                  n_probs=0,
                  # If greater than 0, the response also contains the probabilities of top N tokens for each generated token (default: 0)
+                 pool_size=16,  # Max keep-alive connections kept open to the server.
+                 no_think=False,  # Ask Qwen3 to skip its thinking block (appends /no_think and prefills an empty one).
+                 timeout=None,  # Seconds to wait for the server before giving up (default: wait forever).
+                 context_tokens=8192,  # Context size of one server slot (--ctx-size / --parallel); bounds packed prompts.
                  ):
 
         self.url = url
@@ -81,12 +136,26 @@ class LLM:
         self.ignore_eos = ignore_eos
         self.logit_bias = logit_bias
         self.n_probs = n_probs
+        self.pool_size = pool_size
+        self.no_think = no_think
+        self.timeout = timeout
+        self.context_tokens = context_tokens
+
+        # Reuse TCP connections across requests instead of opening one per completion
+        self.session = requests.Session()
+        self.session.mount(self.url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.async_session = None  # aiohttp.ClientSession, created by the first `acompletion`
 
-    def completion(self, prompt, preset='', callback='', is_question=True):
-        if is_question:
-            prompt = f"<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant"
+        # Prompt cache statistics reported by the server's `timings` block
+        self.stats_lock = threading.Lock()
+        self.prompt_stats = {'requests': 0, 'prompt_tokens': 0, 'prompt_tokens_reused': 0,
+                             'prompt_ms': 0.0, 'predicted_tokens': 0, 'predicted_ms': 0.0}
+        self.local_timings = threading.local()
+
+    def completion(self, prompt, preset='', callback='', is_question=True, grammar=None, slot_id=-1, seed=None, timeout=None):
+        prompt = self.format_prompt(prompt, is_question)
         """Continue the text in `prompt`. Add user/assistant tags by default. If you want to use simple completion, 
-        set is_question to False.
+        set is_question to False. `timeout` overrides the instance's timeout for this request.
         `callback` is called by callback(b'data: {"content":"token","stop":false}').
         Return is like the following:
             {
@@ -142,6 +211,127 @@ class LLM:
         if callback == '':
             callback = None
 
+        data = self.request_data(prompt, preset, grammar, slot_id, seed)
+
+        response = self.session.post(self.url + '/completion', headers={"Content-Type": "application/json"}, data=json.dumps(data),
+                                     timeout=self.timeout if timeout is None else timeout)
+
+        if response.status_code == 200:
+            if callback is not None and callable(callback):
+                for line in response.iter_lines():
+                    if line:
+                        callback(line)
+                return None
+
+            else:
+                result = response.json()
+                self.record_timings(result)
+                return self.answer_content(result)
+
+        else:
+            return None
+
+    def record_timings(self, result):
+        """Keeps the server's `timings` for this thread and adds them to the prompt cache statistics.
+
+        Prompt tokens the server did not have to evaluate (`tokens_evaluated` minus
+        `timings.prompt_n`) were reused from the slot's KV cache.
+        """
+        timings = dict(result.get("timings") or {})
+        prompt_tokens = result.get("tokens_evaluated", timings.get("prompt_n", 0)) or 0
+        reused = max(prompt_tokens - (timings.get("prompt_n") or 0), 0)
+        timings.update(tokens_evaluated=prompt_tokens, tokens_reused=reused,
+                       tokens_cached=result.get("tokens_cached"), id_slot=result.get("id_slot"))
+        self.local_timings.last = timings
+        with self.stats_lock:
+            stats = self.prompt_stats
+            stats['requests'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['prompt_tokens_reused'] += reused
+            stats['prompt_ms'] += timings.get("prompt_ms") or 0.0
+            stats['predicted_tokens'] += timings.get("predicted_n") or 0
+            stats['predicted_ms'] += timings.get("predicted_ms") or 0.0
+        LLAMA_PROMPT_TOKENS.inc(prompt_tokens)
+        LLAMA_PROMPT_TOKENS_REUSED.inc(reused)
+        LLAMA_PREDICTED_TOKENS.inc(timings.get("predicted_n") or 0)
+        if timings.get("prompt_ms") is not None:
+            LLAMA_PROMPT_SECONDS.observe(timings["prompt_ms"] / 1000)
+        if timings.get("predicted_per_second"):
+            LLAMA_PREDICTED_PER_SECOND.observe(timings["predicted_per_second"])
+
+    def last_timings(self):
+        """The server's `timings` of the latest completion on the current thread."""
+        return getattr(self.local_timings, 'last', {})
+
+    def cache_stats(self):
+        """Cumulative prompt cache statistics, including the fraction of prompt tokens reused."""
+        with self.stats_lock:
+            stats = dict(self.prompt_stats)
+        stats['prompt_cache_hit_rate'] = stats['prompt_tokens_reused'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        return stats
+
+    def warm_up(self, prefix, slot_id=-1):
+        """Evaluates the stable start of the prompts into the server's cache without generating anything.
+
+        `prefix` is the beginning of the text later passed to `completion`, so it is wrapped
+        the same way up to its end.
+        """
+        prompt = f"<|im_start|>user\n{prefix}"
+        data = self.request_data(prompt, slot_id=slot_id)
+        data["n_predict"] = 0
+        response = self.session.post(self.url + '/completion', headers={"Content-Type": "application/json"}, data=json.dumps(data), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def answer_content(result):
+        content = result["content"]
+        return content.split("</think>")[1].strip() if "</think>" in content else content
+
+    async def acompletion(self, prompt, preset='', is_question=True, grammar=None, slot_id=-1, seed=None):
+        """Async version of `completion` over a pooled keep-alive aiohttp session.
+
+        Lets one event loop multiplex many requests to the server without holding a
+        thread per request. The session belongs to the event loop that created it;
+        call `aclose` before that loop ends.
+        """
+        import aiohttp  # Only needed for async use
+
+        prompt = self.format_prompt(prompt, is_question)
+
+        if self.async_session is None or self.async_session.closed:
+            self.async_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+
+        data = self.request_data(prompt, preset, grammar, slot_id, seed)
+        data["stream"] = False
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with self.async_session.post(self.url + '/completion', json=data, timeout=timeout) as response:
+            if response.status != 200:
+                return None
+            result = await response.json()
+        self.record_timings(result)
+        return self.answer_content(result)
+
+    async def aclose(self):
+        if self.async_session is not None:
+            await self.async_session.close()
+            self.async_session = None
+
+    def format_prompt(self, prompt, is_question=True):
+        """Wraps `prompt` in the ChatML user/assistant tags unless `is_question` is False."""
+        if not is_question:
+            return prompt
+        if self.no_think:
+            return f"<|im_start|>user\n{prompt} /no_think<|im_end|>\n<|im_start|>assistant\n<think>\n\n</think>\n\n"
+        return f"<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant"
+
+    def request_data(self, prompt, preset='', grammar=None, slot_id=-1, seed=None):
+        """Builds the `/completion` request body for an already formatted `prompt`.
+
+        `grammar` and `seed` override the instance's settings for this request. `slot_id`
+        pins the request to a server slot so consecutive requests reuse its KV cache
+        (-1 lets the server choose).
+        """
         data = {
             "prompt": prompt,
             "temperature": self.temperature,
@@ -161,28 +351,46 @@ class LLM:
             "mirostat": self.mirostat,
             "mirostat_tau": self.mirostat_tau,
             "mirostat_eta": self.mirostat_eta,
-            "grammar": self.grammar,
-            "seed": self.seed,
+            "grammar": self.grammar if grammar is None else grammar,
+            "seed": self.seed if seed is None else seed,
             "ignore_eos": self.ignore_eos,
             "logit_bias": self.logit_bias,
             "cache_prompt": True,
+            "id_slot": slot_id,
             "n_probs": self.n_probs
         }
 
         if preset != '':
             data.update(self.presets[preset])
+        return data
 
-        response = requests.post(self.url + '/completion', headers={"Content-Type": "application/json"}, data=json.dumps(data))
+    def cache_params(self, preset='', grammar=None, slot_id=-1, seed=None, **kwargs):
+        """Sampling settings that, together with the prompt, determine the answer (used for response caching)."""
+        params = self.request_data('', preset, grammar, seed=seed)
+        del params["prompt"], params["stream"], params["id_slot"]
+        params.update(kwargs, no_think=self.no_think)
+        return params
 
-        if response.status_code == 200:
-            if callback is not None and callable(callback):
-                for line in response.iter_lines():
-                    if line:
-                        callback(line)
-                return None
+    def completion_stream(self, prompt, preset='', is_question=True, grammar=None, slot_id=-1, seed=None, timeout=None):
+        """Like `completion`, but yields the generated text piece by piece as the server streams it.
 
-            else:
-                return response.json()["content"].split("</think>")[1].strip() if "</think>" in response.json()["content"] else response.json()["content"]
+        `timeout` limits each wait for the server, not the whole stream.
+        """
+        prompt = self.format_prompt(prompt, is_question)
 
-        else:
-            return None
\ No newline at end of file
+        data = self.request_data(prompt, preset, grammar, slot_id, seed)
+        data["stream"] = True
+
+        with self.session.post(self.url + '/completion', headers={"Content-Type": "application/json"},
+                               data=json.dumps(data), stream=True,
+                               timeout=self.timeout if timeout is None else timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b'data: '):
+                    continue
+                chunk = json.loads(line[len(b'data: '):])
+                if chunk.get("content"):
+                    yield chunk["content"]
+                if chunk.get("stop"):
+                    self.record_timings(chunk)
+                    break
@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+
+
+class BackendRace:
+    """Sends one prompt to several backends at once and keeps the first answer that validates.
+
+    Every attempt gets its own thread and streams its answer. Once a backend wins,
+    `cancelled` is set and the losers close their streams at the next piece, which
+    drops the HTTP request and frees their admission place; losers still waiting in
+    an admission queue give up their place in it. Latency is therefore bounded by the
+    fastest healthy backend, and a race never waits behind the losers of earlier ones.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wins = {}  # backend name -> races won
+        self.failures = {}  # backend name -> answers that failed or did not validate
+        self.races = 0
+        self.lost_races = 0  # Races where no backend produced a valid answer
+
+    def run(self, prompt, llms, validator, timeout=None, cancelled=None):
+        """Returns (winner name, answer, validator result).
+
+        `llms` maps backend names to objects with `completion_stream(prompt)`. `cancelled`
+        is a threading.Event set when the race is decided; pass the same event to the
+        backends so they can stop waiting for admission. Raises ValueError with every
+        backend's error when none of them produced a valid answer in time.
+        """
+        cancelled = cancelled or threading.Event()
+        results = queue.Queue()
+
+        def attempt(name, llm):
+            start = time.perf_counter()
+            try:
+                answer = ""
+                stream = llm.completion_stream(prompt)
+                try:
+                    for piece in stream:
+                        if cancelled.is_set():
+                            results.put((name, None, 'cancelled', 0))
+                            return
+                        answer += piece
+                finally:
+                    stream.close()
+                results.put((name, answer, validator(answer), time.perf_counter() - start))
+            except Exception as e:
+                results.put((name, None, e, 0))
+
+        for name, llm in llms.items():
+            threading.Thread(target=attempt, args=(name, llm), name=f'race-{name}', daemon=True).start()
+        pending = set(llms)
+        errors = {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            self.races += 1
+
+        try:
+            while pending:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    name, answer, result, elapsed = results.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.discard(name)
+                if answer is None:
+                    errors[name] = str(result)
+                    with self.lock:
+                        self.failures[name] = self.failures.get(name, 0) + 1
+                    continue
+                with self.lock:
+                    self.wins[name] = self.wins.get(name, 0) + 1
+                print(f"Race won by {name} in {elapsed:.2f}s")
+                return name, answer, result
+        finally:
+            cancelled.set()
+
+        for name in pending:
+            errors[name] = 'timed out'
+        with self.lock:
+            self.lost_races += 1
+        raise ValueError(f"No backend returned a valid answer: {errors}")
+
+    def stats(self):
+        with self.lock:
+            return {'races': self.races, 'lost_races': self.lost_races,
+                    'wins': dict(self.wins), 'failures': dict(self.failures)}
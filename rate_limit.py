@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import deque
+
+from admission import AdmissionError
+
+
+class BudgetExhausted(AdmissionError):
+    """Waited too long for rate budget. Answered with 429 and Retry-After like a full queue."""
+
+    status = 429
+
+
+class TokenBucket:
+    """Allows `per_minute` units per minute, refilled continuously, with at most a minute's worth saved up."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` can be taken. Larger-than-capacity amounts need a full bucket."""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount):
+        self.level -= amount  # May go below zero: the debt is paid back before the next request
+
+
+class RateScheduler:
+    """Client-side requests-per-minute and tokens-per-minute budgets per model.
+
+    A request reserves one request and its token count before it is sent. When the
+    budget is short, `acquire` queues it (first come, first served) and wakes it when
+    the buckets have refilled enough, so callers do not all hit the API limit and
+    retry in lockstep. `try_acquire` never waits, which lets a caller send the
+    request to another model instead. Models without limits are never throttled.
+    """
+
+    def __init__(self, limits):
+        self.condition = threading.Condition()
+        self.buckets = {}  # model name -> [TokenBucket, ...]
+        self.queues = {}  # model name -> deque of waiting tickets
+        for model_name, (rpm, tpm) in limits.items():
+            self.buckets[model_name] = [(TokenBucket(rpm), 'requests') if rpm else None,
+                                        (TokenBucket(tpm), 'tokens') if tpm else None]
+            self.queues[model_name] = deque()
+        self.counters = {'immediate': 0, 'queued': 0, 'timed_out': 0, 'rate_limited': 0}
+
+    def _wait_time(self, model_name, tokens, now):
+        wait = 0.0
+        for entry in self.buckets.get(model_name, ()):
+            if entry is not None:
+                bucket, kind = entry
+                wait = max(wait, bucket.wait_time(1 if kind == 'requests' else tokens, now))
+        return wait
+
+    def _take(self, model_name, tokens):
+        for entry in self.buckets.get(model_name, ()):
+            if entry is not None:
+                bucket, kind = entry
+                bucket.take(1 if kind == 'requests' else tokens)
+
+    def wait_time(self, model_name, tokens):
+        """Rough seconds until a request of `tokens` would be let through, counting the ones already waiting."""
+        with self.condition:
+            queued = len(self.queues.get(model_name, ()))
+            return self._wait_time(model_name, tokens, time.monotonic()) * (queued + 1)
+
+    def try_acquire(self, model_name, tokens):
+        """Reserves budget for one request if it is available right now and nobody is waiting."""
+        with self.condition:
+            if self.queues.get(model_name) or self._wait_time(model_name, tokens, time.monotonic()) > 0:
+                return False
+            self._take(model_name, tokens)
+            self.counters['immediate'] += 1
+            return True
+
+    def acquire(self, model_name, tokens, timeout=None):
+        """Waits in line until budget for one request of `tokens` is free, then reserves it.
+
+        Raises BudgetExhausted if that takes longer than `timeout` seconds.
+        """
+        if model_name not in self.queues:
+            return
+        ticket = object()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            queue = self.queues[model_name]
+            queue.append(ticket)
+            self.counters['queued'] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(model_name, tokens, now) if queue[0] is ticket else None
+                    if wait == 0:
+                        self._take(model_name, tokens)
+                        return
+                    remaining = None if deadline is None else deadline - now
+                    if remaining is not None and remaining <= 0:
+                        self.counters['timed_out'] += 1
+                        raise BudgetExhausted(f"Rate budget of {model_name} exhausted",
+                                              max(1, int(round(wait or self._wait_time(model_name, tokens, now)))))
+                    self.condition.wait(wait if remaining is None else min(remaining, wait or remaining))
+            finally:
+                queue.remove(ticket)
+                self.condition.notify_all()
+
+    def settle(self, model_name, reserved_tokens, used_tokens):
+        """Corrects a reservation once the API has reported the tokens the request really used."""
+        with self.condition:
+            entry = self.buckets.get(model_name, [None, None])[1]
+            if entry is not None:
+                entry[0].take(used_tokens - reserved_tokens)
+            self.condition.notify_all()
+
+    def exhausted(self, model_name, retry_after):
+        """The API answered 429 anyway: hold the model's requests back for `retry_after` seconds."""
+        with self.condition:
+            self.counters['rate_limited'] += 1
+            now = time.monotonic()
+            for entry in self.buckets.get(model_name, ()):
+                if entry is not None:
+                    bucket = entry[0]
+                    bucket.refill(now)
+                    bucket.level = min(bucket.level, -bucket.rate * retry_after)
+
+    def stats(self):
+        with self.condition:
+            now = time.monotonic()
+            stats = dict(self.counters)
+            for model_name, entries in self.buckets.items():
+                for entry in entries:
+                    if entry is not None:
+                        bucket, kind = entry
+                        bucket.refill(now)
+                        stats[f'{model_name}_{kind}_available'] = round(bucket.level, 1)
+                stats[f'{model_name}_waiting'] = len(self.queues[model_name])
+            return stats
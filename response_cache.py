@@ -0,0 +1,163 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Exact-match cache of LLM answers.
+
+    Entries are keyed by a hash of the final prompt, the model and its sampling
+    settings. Since the prompt embeds the glossary lines, the few-shot context
+    and the user prompt, changing any of them produces a different key, so stale
+    answers are never served; they just age out of the LRU or expire.
+
+    The in-memory tier is an LRU bounded by `max_entries` and `ttl_seconds`. When
+    `sqlite_path` is set, entries are also written to a SQLite table that survives
+    restarts and is consulted on memory misses.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=24 * 3600, sqlite_path=None, max_disk_entries=50000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (created, answer)
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'stores': 0}
+        self.db = None
+        if sqlite_path:
+            self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, answer TEXT, created REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+            self.db.commit()
+
+    @staticmethod
+    def make_key(prompt, model, params):
+        payload = json.dumps([prompt, model, params], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                del self.entries[key]
+                self.counters['expirations'] += 1
+
+            if self.db is not None:
+                row = self.db.execute("SELECT answer, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        self._remember(key, row[1], row[0])
+                        self.counters['disk_hits'] += 1
+                        return row[0]
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.db.commit()
+                    self.counters['expirations'] += 1
+
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, key, answer):
+        now = time.time()
+        with self.lock:
+            self._remember(key, now, answer)
+            self.counters['stores'] += 1
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses (key, answer, created) VALUES (?, ?, ?)", (key, answer, now))
+                count = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_disk_entries:
+                    self.db.execute("DELETE FROM responses WHERE key IN "
+                                    "(SELECT key FROM responses ORDER BY created LIMIT ?)", (count - self.max_disk_entries,))
+                    self.counters['evictions'] += count - self.max_disk_entries
+                self.db.commit()
+
+    def _remember(self, key, created, answer):
+        self.entries[key] = (created, answer)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses")
+                self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+            if self.db is not None:
+                stats['disk_entries'] = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return stats
+
+
+class CachedLLM:
+    """Wraps a backend so `completion`/`completion_stream` consult a ResponseCache first.
+
+    Only answers accepted by `validator` are stored, so errors and malformed
+    generations are retried instead of cached. With `refresh=True` the lookup is
+    skipped but the new answer still replaces the cached one.
+    """
+
+    def __init__(self, llm, cache, model_name, validator=None, refresh=False):
+        self.llm = llm
+        self.cache = cache
+        self.model_name = model_name
+        self.validator = validator
+        self.refresh = refresh
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def cache_key(self, prompt, **kwargs):
+        params = self.llm.cache_params(**kwargs) if hasattr(self.llm, 'cache_params') else {}
+        return self.cache.make_key(prompt, self.model_name, params)
+
+    def _valid(self, answer):
+        if answer is None:
+            return False
+        if self.validator is None:
+            return True
+        try:
+            self.validator(answer)
+            return True
+        except Exception:
+            return False
+
+    def completion(self, prompt, **kwargs):
+        key = self.cache_key(prompt, **kwargs)
+        if not self.refresh:
+            answer = self.cache.get(key)
+            if answer is not None:
+                return answer
+        answer = self.llm.completion(prompt, **kwargs)
+        if self._valid(answer):
+            self.cache.put(key, answer)
+        return answer
+
+    def completion_stream(self, prompt, **kwargs):
+        key = self.cache_key(prompt, **kwargs)
+        if not self.refresh:
+            answer = self.cache.get(key)
+            if answer is not None:
+                yield answer
+                return
+        answer = ""
+        for piece in self.llm.completion_stream(prompt, **kwargs):
+            answer += piece
+            yield piece
+        if self._valid(answer):
+            self.cache.put(key, answer)
@@ -0,0 +1,39 @@
+"""Production entry point.
+
+Serves the app with waitress, a multi-threaded WSGI server, instead of Flask's
+debug server. Concurrency towards each LLM backend is bounded separately by the
+admission queues in app.py (QWEN_MAX_IN_FLIGHT, QWEN_MAX_QUEUE, GEMINI_MAX_IN_FLIGHT,
+GEMINI_MAX_QUEUE, REQUEST_DEADLINE); the server only needs enough threads to hold
+the queued requests:
+
+    python serve.py --port 5002 --threads 32
+"""
+import argparse
+import threading
+
+from app import app, warm_up_qwen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the translation assistant with a production WSGI server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--threads', type=int, default=32, help="Worker threads; should cover the backends' in-flight + queue limits")
+    parser.add_argument('--no-warm-up', action='store_true', help="Skip evaluating the prompt prefix into llama.cpp at startup")
+    args = parser.parse_args(argv)
+
+    if not args.no_warm_up:
+        threading.Thread(target=warm_up_qwen, daemon=True).start()
+
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress is not installed (pip install waitress); falling back to Flask's threaded server.")
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+
+    serve(app, host=args.host, port=args.port, threads=args.threads, connection_limit=max(100, args.threads * 4))
+
+
+if __name__ == '__main__':
+    main()
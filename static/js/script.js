@@ -5,6 +5,9 @@ document.addEventListener('DOMContentLoaded', () => {
     const updatePromptButton = document.getElementById('update-prompt-button');
     updatePromptButton.addEventListener('click', handleUpdatePromptClick);
 
+    document.getElementById('load-document-button').addEventListener('click', handleLoadDocumentClick);
+    document.getElementById('next-sentence-button').addEventListener('click', handleNextSentenceClick);
+
     // Load existing prompt if available
     loadPrompt();
 
@@ -18,24 +21,20 @@ async function handleTranslateClick() {
     const errorMessageDiv = document.getElementById('error-message');
     errorMessageDiv.textContent = '';
 
-    // Get the selected model
-    const modelRadios = document.getElementsByName('model');
-    let selectedModel = 'qwen'; // Default value
-    for (let radio of modelRadios) {
-        if (radio.checked) {
-            selectedModel = radio.value;
-            break;
-        }
-    }
+    const selectedModel = getSelectedModel();
+
+    const container = document.getElementById('alternatives-container');
+    container.innerHTML = '';
 
     try {
-        const response = await fetch('/translate', {
+        const response = await fetch('/translate/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 original_sentence: originalText,
                 saved_translations: savedTranslations,
-                model: selectedModel
+                model: selectedModel,
+                session_id: getSessionId()
             })
         });
 
@@ -44,47 +43,170 @@ async function handleTranslateClick() {
             throw new Error(errorData.error || `Server error: ${response.status}`);
         }
 
+        // Alternatives are shown one by one as the server finishes them, below the raw text generated so far
+        let tmMatchElement = null;
+        const preview = document.createElement('pre');
+        preview.className = 'stream-preview';
+        await readServerSentEvents(response, (event, data) => {
+            if (event === 'tm_match') {
+                tmMatchElement = createTmMatchElement(originalText, data);
+                container.prepend(tmMatchElement);
+            } else if (event === 'token') {
+                if (!preview.isConnected) {
+                    container.appendChild(preview);
+                }
+                preview.textContent += data.text;
+            } else if (event === 'alternative') {
+                container.insertBefore(createAlternativeElement(originalText, data.text, data.index),
+                                       preview.isConnected ? preview : null);
+            } else if (event === 'done') {
+                if (data.model !== 'tm') {  // Else the TM match is the whole answer and is already shown
+                    displayAlternatives(originalText, data.alternatives);
+                }
+                if (tmMatchElement) {
+                    container.prepend(tmMatchElement);
+                }
+            } else if (event === 'error') {
+                preview.remove();
+                throw new Error(data.error);
+            }
+        });
+    } catch (error) {
+        console.error("Error translating:", error);
+        errorMessageDiv.textContent = error.message;
+    }
+}
+
+// Sends the text to the server, which splits it and translates the upcoming sentences in the background
+async function handleLoadDocumentClick() {
+    const errorMessageDiv = document.getElementById('error-message');
+    errorMessageDiv.textContent = '';
+    try {
+        const response = await fetch('/prefetch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                text: document.getElementById('document-input').value,
+                model: getSelectedModel(),
+                session_id: getSessionId()
+            })
+        });
         const data = await response.json();
-        if (data.alternatives) {
-            displayAlternatives(originalText, data.alternatives);
+        if (!response.ok) {
+            throw new Error(data.error || `Server error: ${response.status}`);
         }
+        sessionStorage.setItem('documentSentences', JSON.stringify(data.sentences));
+        showDocumentSentence(0);
     } catch (error) {
-        console.error("Error translating:", error);
+        console.error("Error loading text:", error);
         errorMessageDiv.textContent = error.message;
     }
 }
 
+function handleNextSentenceClick() {
+    showDocumentSentence(parseInt(sessionStorage.getItem('documentPosition') || '-1', 10) + 1);
+}
+
+function showDocumentSentence(position) {
+    const sentences = JSON.parse(sessionStorage.getItem('documentSentences') || '[]');
+    if (position >= sentences.length) {
+        return;
+    }
+    sessionStorage.setItem('documentPosition', position);
+    document.getElementById('document-position').textContent = `${position + 1} / ${sentences.length}`;
+    document.getElementById('original-text-input').value = sentences[position];
+    handleTranslateClick();
+}
+
+function getSelectedModel() {
+    for (let radio of document.getElementsByName('model')) {
+        if (radio.checked) {
+            return radio.value;
+        }
+    }
+    return 'qwen';
+}
+
+async function readServerSentEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        let separator;
+        while ((separator = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
 function displayAlternatives(originalSentence, alternativesArray) {
     const container = document.getElementById('alternatives-container');
     container.innerHTML = '';
 
     alternativesArray.forEach((alternative, index) => {
-        const div = document.createElement('div');
-        div.className = 'alternative';
+        container.appendChild(createAlternativeElement(originalSentence, alternative, index));
+    });
+}
 
-        const header = document.createElement('h3');
-        header.textContent = `Alternative ${index + 1}`;
-        div.appendChild(header);
+function createAlternativeElement(originalSentence, alternative, index) {
+    const div = document.createElement('div');
+    div.className = 'alternative';
 
-        const text = document.createElement('p');
-        text.innerHTML = alternative;
-        div.appendChild(text);
+    const header = document.createElement('h3');
+    header.textContent = `Alternative ${index + 1}`;
+    div.appendChild(header);
 
-        const editButton = document.createElement('button');
-        editButton.className = 'edit-button';
-        editButton.textContent = 'Edit';
-        editButton.addEventListener('click', () => handleEditClick(index, text, div));
-        div.appendChild(editButton);
+    const text = document.createElement('p');
+    text.innerHTML = alternative;
+    div.appendChild(text);
 
+    const editButton = document.createElement('button');
+    editButton.className = 'edit-button';
+    editButton.textContent = 'Edit';
+    editButton.addEventListener('click', () => handleEditClick(index, text, div));
+    div.appendChild(editButton);
 
-        const saveButton = document.createElement('button');
-        saveButton.className = 'save-button';
-        saveButton.textContent = 'Save to File';
-        saveButton.addEventListener('click', () => saveTranslationToFile(originalSentence, alternative));
-        div.appendChild(saveButton);
 
-        container.appendChild(div);
-    });
+    const saveButton = document.createElement('button');
+    saveButton.className = 'save-button';
+    saveButton.textContent = 'Save to File';
+    saveButton.addEventListener('click', () => saveTranslationToFile(originalSentence, alternative));
+    div.appendChild(saveButton);
+
+    return div;
+}
+
+// A saved translation of the same or a nearly identical sentence, shown above the LLM alternatives
+function createTmMatchElement(originalSentence, match) {
+    const div = createAlternativeElement(originalSentence, match.translation, -1);
+    div.classList.add('tm-match');
+    div.querySelector('h3').textContent = `TM match (${Math.round(match.similarity * 100)}%)`;
+    if (match.original !== originalSentence) {
+        const source = document.createElement('p');
+        source.className = 'tm-match-original';
+        source.textContent = match.original;
+        div.insertBefore(source, div.querySelector('h3').nextSibling);
+    }
+    return div;
 }
 
 function handleEditClick(index, currentTextElement, alternativeDiv) {
@@ -195,22 +317,48 @@ function loadPrompt() {
     });
 }
 
-function loadTranslations() {
-    fetch('/get_translations')
-    .then(response => {
-        if (!response.ok) {
-            throw new Error('Failed to load translations');
+// The saved translations are mirrored in localStorage; only the entries changed since the
+// mirrored version are fetched, page by page, and a 304 means the mirror is up to date.
+async function loadTranslations() {
+    const mirror = JSON.parse(localStorage.getItem('translationMirror') || 'null') || { version: null, entries: {} };
+    try {
+        let cursor = mirror.version;
+        while (true) {
+            const params = new URLSearchParams({ limit: 1000 });
+            if (cursor) {
+                params.set('since', cursor);
+            }
+            const headers = cursor === mirror.version && mirror.etag ? { 'If-None-Match': mirror.etag } : {};
+            const response = await fetch(`/get_translations?${params}`, { headers });
+            if (response.status === 304) {
+                break;
+            }
+            if (!response.ok) {
+                throw new Error('Failed to load translations');
+            }
+            const data = await response.json();
+            if (data.reset) {
+                mirror.entries = {};
+            }
+            data.translations.forEach(entry => {
+                mirror.entries[entry.original] = entry.translation;
+            });
+            if (!data.next_cursor) {
+                mirror.version = data.version;
+                mirror.etag = response.headers.get('ETag');
+                break;
+            }
+            cursor = data.next_cursor;
         }
-        return response.json();
-    })
-    .then(data => {
-        if (data.translations) {
-            displayTranslations(data.translations);
+        try {
+            localStorage.setItem('translationMirror', JSON.stringify(mirror));
+        } catch (error) {
+            console.warn('Could not store the translations in localStorage:', error);
         }
-    })
-    .catch(error => {
+    } catch (error) {
         console.error('Error loading translations:', error);
-    });
+    }
+    displayTranslations(Object.entries(mirror.entries).map(([original, translation]) => ({ original, translation })));
 }
 
 function displayTranslations(translations) {
@@ -21,6 +21,16 @@ function highlightDifferences(baseString, comparisonStringsArray) {
 }
 
 
+// Identifies this tab so the server can keep its requests on the same llama.cpp slot
+function getSessionId() {
+    let sessionId = sessionStorage.getItem('sessionId');
+    if (!sessionId) {
+        sessionId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+        sessionStorage.setItem('sessionId', sessionId);
+    }
+    return sessionId;
+}
+
 function loadSavedTranslations() {
     const translations = localStorage.getItem('savedTranslations');
     return translations ? JSON.parse(translations) : [];
@@ -0,0 +1,11 @@
+import re
+
+CJK_PATTERN = re.compile(r'[　-ヿ㐀-䶿一-鿿豈-﫿＀-￯]')
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate: about one token per CJK character and four characters per token otherwise."""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
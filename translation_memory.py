@@ -0,0 +1,226 @@
+import bisect
+import os
+import threading
+import time
+
+import yaml
+
+from context_index import NgramIndex
+from fuzzy_match import FuzzyIndex
+
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class TranslationMemory:
+    """Process-wide store of saved translations backed by `translations.yaml`.
+
+    The file is parsed once and kept in a dict keyed by the original sentence, so
+    lookups and upserts are O(1). Saving appends a single YAML list item to the
+    end of the file instead of dumping the whole list again; since later items
+    win on load, the file works as an append-only log. When superseded records
+    pile up the file is compacted with one full rewrite. If the file is changed by
+    someone else (its mtime or size differ from what we last wrote) it is reloaded
+    on the next access.
+
+    Every change gets an increasing version number, so clients can page through
+    the entries in change order and later fetch only what changed since the last
+    version they saw. Versions are only comparable within one `generation`, which
+    changes whenever the file is (re)loaded.
+    """
+
+    COMPACT_MIN_RECORDS = 64  # Do not bother compacting tiny files.
+    COMPACT_RATIO = 2.0  # Compact when the log holds this many records per live entry.
+
+    def __init__(self, path='translations.yaml', fuzzy_threshold=0.8):
+        self.path = path
+        self.lock = threading.RLock()
+        self.entries = {}  # original -> translation, in first-saved order
+        self.log_records = 0  # Number of records currently in the file, including superseded ones.
+        self.file_stamp = None
+        self.load_error = None  # Why the file could not be parsed last time; saving is refused until it can
+        self.index = NgramIndex()  # Relevance index over the originals
+        self.fuzzy_index = FuzzyIndex(fuzzy_threshold)  # Near-duplicate lookup over the originals
+        self.generation = None
+        self.version = 0  # Version of the latest change
+        self.versions = {}  # original -> version of its latest change
+        self.changes = []  # (version, original) in version order, including superseded changes
+        self.load()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """(Re)reads the whole file. Later records for the same original replace earlier ones."""
+        with self.lock:
+            entries = {}
+            versions = {}
+            records = 0
+            stamp = self._stamp()
+            if stamp is not None:
+                try:
+                    with open(self.path, 'r', encoding="utf-8") as f:
+                        translations = yaml.load(f, Loader=YAML_LOADER) or []
+                    for entry in translations:
+                        records += 1
+                        entries[entry.get('original', '')] = entry.get('translation', '')
+                        versions[entry.get('original', '')] = records
+                except Exception as e:
+                    # Keep serving the last good state, and do not write over a file we could not read
+                    print(f"Error reading {self.path}: {e}")
+                    self.load_error = str(e)
+                    self.file_stamp = stamp  # Tried again once the file changes
+                    if self.generation is None:
+                        self.generation = format(time.time_ns(), 'x')
+                    return
+            self.load_error = None
+            self.entries = entries
+            self.log_records = records
+            self.file_stamp = stamp
+            self.generation = format(time.time_ns(), 'x')
+            self.version = records
+            self.versions = versions
+            self.changes = sorted((version, original) for original, version in versions.items())
+            index = NgramIndex()  # Built aside and swapped in, so searches never see a half-built index
+            for original in entries:
+                index.add(original, original)
+            self.index = index
+            self.fuzzy_index.build((original, original) for original in entries)
+
+    def refresh(self):
+        """Reloads the file if it was modified outside of this process."""
+        with self.lock:
+            if self._stamp() != self.file_stamp:
+                self.load()
+
+    def get(self, original):
+        with self.lock:
+            self.refresh()
+            return self.entries.get(original)
+
+    def all(self):
+        """Returns the saved translations as a list of {'original', 'translation'} dicts."""
+        with self.lock:
+            self.refresh()
+            return [{'original': original, 'translation': translation}
+                    for original, translation in self.entries.items()]
+
+    def changes_since(self, version=0, limit=None, query=None):
+        """Returns (entries, last version scanned) for entries changed after `version`, oldest change first.
+
+        Each entry is {'original', 'translation', 'version'}. With `query` only entries whose
+        original or translation contains it are returned. When `limit` entries were found,
+        pass the returned version back to get the next page; otherwise it is the current
+        version.
+        """
+        with self.lock:
+            self.refresh()
+            found = []
+            last = self.version
+            for position in range(bisect.bisect_left(self.changes, (version + 1,)), len(self.changes)):
+                change_version, original = self.changes[position]
+                if self.versions.get(original) != change_version:
+                    continue  # Superseded by a later change
+                translation = self.entries[original]
+                if query and query not in original and query not in translation:
+                    continue
+                found.append({'original': original, 'translation': translation, 'version': change_version})
+                if limit is not None and len(found) >= limit:
+                    last = change_version
+                    break
+            return found, last
+
+    def search(self, sentence, k=10):
+        """Returns up to `k` saved translations whose originals are most similar to `sentence`, best first.
+
+        The scoring runs under the index's own lock only, so reads and saves do not wait for it.
+        """
+        with self.lock:
+            self.refresh()
+        found = self.index.search(sentence, k)
+        with self.lock:
+            return [{'original': original, 'translation': self.entries[original]}
+                    for original, _ in found if original in self.entries]
+
+    def fuzzy_match(self, sentence):
+        """Returns the saved translation whose original is nearly the same sentence, or None.
+
+        The result is {'original', 'translation', 'similarity'}, with similarity in
+        [threshold, 1]; 1 means the originals differ at most in punctuation, width or
+        ruby readings.
+        """
+        with self.lock:
+            self.refresh()
+            match = self.fuzzy_index.best_match(sentence)
+            if match is None:
+                return None
+            original, similarity = match
+            return {'original': original, 'translation': self.entries[original], 'similarity': similarity}
+
+    def __len__(self):
+        with self.lock:
+            self.refresh()
+            return len(self.entries)
+
+    def __contains__(self, original):
+        with self.lock:
+            self.refresh()
+            return original in self.entries
+
+    def upsert(self, original, translation):
+        """Adds or updates a translation and persists it by appending to the log.
+
+        Raises RuntimeError while the file cannot be parsed, so a damaged file is never
+        compacted down to what this process still holds.
+        """
+        with self.lock:
+            self.refresh()
+            if self.load_error is not None:
+                raise RuntimeError(f"{self.path} could not be read ({self.load_error}); fix it before saving")
+            if self.entries.get(original) == translation:
+                return
+            if original not in self.entries:
+                self.index.add(original, original)
+                self.fuzzy_index.add(original, original)
+            self.entries[original] = translation
+            self.version += 1
+            self.versions[original] = self.version
+            self.changes.append((self.version, original))
+            if len(self.changes) > 2 * len(self.entries) + self.COMPACT_MIN_RECORDS:
+                self.changes = sorted((version, original) for original, version in self.versions.items())
+            if self.log_records == 0:
+                # The file is missing, empty or holds a flow-style `[]`, which cannot be appended to.
+                self.compact()
+                return
+
+            record = yaml.dump([{'original': original, 'translation': translation}], Dumper=YAML_DUMPER,
+                               default_flow_style=False, allow_unicode=True)
+            with open(self.path, 'ab+') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        record = '\n' + record
+                f.write(record.encode("utf-8"))
+            self.log_records += 1
+            self.file_stamp = self._stamp()
+
+            if self.log_records >= self.COMPACT_MIN_RECORDS and \
+                    self.log_records > self.COMPACT_RATIO * len(self.entries):
+                self.compact()
+
+    def compact(self):
+        """Rewrites the file with one record per original, dropping superseded records."""
+        with self.lock:
+            translations = [{'original': original, 'translation': translation}
+                            for original, translation in self.entries.items()]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding="utf-8") as f:
+                yaml.dump(translations, f, Dumper=YAML_DUMPER, default_flow_style=False, allow_unicode=True)
+            os.replace(tmp_path, self.path)
+            self.log_records = len(translations)
+            self.file_stamp = self._stamp()